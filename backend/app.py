@@ -1,21 +1,39 @@
 import os
+import sys
 import tempfile
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-import fitz  # PyMuPDF
-from sentence_transformers import SentenceTransformer
-import faiss
 import numpy as np
 import re
 import requests
 import json
-import speech_recognition as sr
-from pydub import AudioSegment
 import traceback
 import logging
+import hashlib
+import threading
+import queue
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from youtube_transcript_api import YouTubeTranscriptApi
 from urllib.parse import urlparse, parse_qs
+from storage import DocumentStorage, ChunkList
+from cache import BoundedCache, SemanticAnswerCache
+from embedding_service import EmbeddingBatcher
+from corpus import CorpusIndex, enable_reconstruction, index_vectors
+from bm25 import BM25Index
+from ollama_client import OllamaClient, OllamaMonitor, OllamaUnavailable
+from llm_scheduler import LLMScheduler, LLMQueueFull
+from lazy import LazyModule
+from pdf_pages import extract_pdf_pages, get_pdf_pool, discard_pdf_pool
+from json_salvage import salvage_json_items
+# Heavy optional dependencies are imported on first use to keep startup fast
+fitz = LazyModule('fitz')  # PyMuPDF
+faiss = LazyModule('faiss')
+sr = LazyModule('speech_recognition')
+pydub = LazyModule('pydub')
+youtube_transcript_api = LazyModule('youtube_transcript_api')
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,20 +41,175 @@ app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})  # Allow all origins for development
 # Configuration
 OLLAMA_MODEL = "ibm/granite3.3:2b"
-UPLOAD_FOLDER = tempfile.mkdtemp()
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+OLLAMA_BASE_URL = os.environ.get('STUDYMATE_OLLAMA_URL', 'http://localhost:11434')
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get('STUDYMATE_OLLAMA_CONNECT_TIMEOUT', 5))  # seconds
+OLLAMA_READ_TIMEOUT = float(os.environ.get('STUDYMATE_OLLAMA_TIMEOUT', 180))  # seconds; between chunks when streaming
+OLLAMA_POOL_SIZE = 10  # Keep-alive connections shared by all request threads
+OLLAMA_MONITOR_INTERVAL = float(os.environ.get('STUDYMATE_OLLAMA_MONITOR_INTERVAL', 30))  # seconds between probes while up
+OLLAMA_MONITOR_DOWN_INTERVAL = 5  # seconds between probes while down
+OLLAMA_KEEP_ALIVE = os.environ.get('STUDYMATE_OLLAMA_KEEP_ALIVE', '30m')  # Keeps the model and its cached prompt prefix loaded
+LLM_MAX_CONCURRENCY = int(os.environ.get('STUDYMATE_LLM_CONCURRENCY', 2))  # Generations sent to Ollama at once
+LLM_MAX_QUEUE = int(os.environ.get('STUDYMATE_LLM_QUEUE', 16))  # Waiting generations before requests get 429
+LLM_QUEUE_TIMEOUT = 300  # seconds a request may wait for a generation slot
+LLM_PRIORITY_QA = 0  # Interactive questions go first
+LLM_PRIORITY_QUIZ = 1  # Quizzes and batched questions
+LLM_PRIORITY_PLAN = 2  # Study plans
 app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024  # 200MB max file size
-# Initialize Embeddings
+DOCUMENT_CACHE_MAX_BYTES = int(os.environ.get('STUDYMATE_DOCUMENT_CACHE_MB', 1024)) * 1024 * 1024
+DOCUMENT_CACHE_TTL = int(os.environ.get('STUDYMATE_DOCUMENT_CACHE_TTL', 24 * 3600))  # seconds
+QUERY_CACHE_MAX_BYTES = int(os.environ.get('STUDYMATE_QUERY_CACHE_MB', 16)) * 1024 * 1024
+ANSWER_CACHE_THRESHOLD = float(os.environ.get('STUDYMATE_ANSWER_CACHE_THRESHOLD', 0.92))  # Cosine similarity for a hit
+QUIZ_CACHE_MAX_BYTES = int(os.environ.get('STUDYMATE_QUIZ_CACHE_MB', 64)) * 1024 * 1024
+QUIZ_CACHE_TTL = int(os.environ.get('STUDYMATE_QUIZ_CACHE_TTL', 6 * 3600))  # seconds
+PROMPT_SESSION_MAX_BYTES = int(os.environ.get('STUDYMATE_PROMPT_SESSION_CACHE_MB', 32)) * 1024 * 1024
+PROMPT_SESSION_TTL = int(os.environ.get('STUDYMATE_PROMPT_SESSION_TTL', 1800))  # Idle seconds before a follow-up session is dropped
+PDF_EXTRACT_WORKERS = int(os.environ.get('STUDYMATE_PDF_WORKERS', os.cpu_count() or 1))
+PDF_PARALLEL_MIN_PAGES = 64  # Below this, process pool startup outweighs the speedup
+PDF_SHARD_MAX_PAGES = 16  # Pages per worker task, so in-flight text stays small for large PDFs
+PDF_INFLIGHT_SHARDS_PER_WORKER = 2  # Shards extracted ahead of the consumer
+EMBED_BATCH_SIZE = 32
+EMBED_BATCH_WINDOW_MS = float(os.environ.get('STUDYMATE_EMBED_BATCH_WINDOW_MS', 5))
+EMBED_MAX_BATCH_SIZE = 128  # Texts coalesced into one shared forward pass
+CHUNK_SIZE_TOKENS = 254  # all-MiniLM-L6-v2 truncates inputs past 256 tokens, [CLS] and [SEP] included
+CHUNK_OVERLAP_TOKENS = 40
+TOKEN_COUNT_BATCH = 1024  # Sentences tokenized per tokenizer call
+PIPELINE_QUEUE_BATCHES = 4  # Chunk batches buffered between extraction and embedding
+FLAT_INDEX_MAX_VECTORS = int(os.environ.get('STUDYMATE_FLAT_INDEX_MAX_VECTORS', 20000))  # Exact search below this
+ANN_INDEX_TYPE = os.environ.get('STUDYMATE_ANN_INDEX', 'hnsw').lower()  # 'hnsw' or 'ivf' above the threshold
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = int(os.environ.get('STUDYMATE_HNSW_EF_SEARCH', 64))
+IVF_NPROBE = int(os.environ.get('STUDYMATE_IVF_NPROBE', 16))
+INDEX_COMPRESSION = os.environ.get('STUDYMATE_INDEX_COMPRESSION', 'none').lower()  # none, fp16, sq8 or pq
+INDEX_RERANK = os.environ.get('STUDYMATE_INDEX_RERANK', 'none').lower()  # none, flat or fp16 vectors for re-ranking
+RERANK_K_FACTOR = 4  # Candidates fetched from the compressed index per result when re-ranking
+PQ_SUBQUANTIZERS = 48  # 384 dimensions / 48 = 8 dimensions per 1-byte code
+PQ_MIN_TRAIN_VECTORS = 39 * 256  # FAISS's minimum for training 256 centroids per sub-quantizer; smaller documents fall back to SQ8
+RETRIEVAL_TOP_K = 8  # Chunks selected by MMR; the prompt packer keeps as many as fit the context budget
+MMR_LAMBDA = 0.7  # Relevance vs. novelty trade-off; overlapping neighbour chunks score as redundant
+HYBRID_CANDIDATES = 20  # Dense and BM25 candidates each considered for fusion
+RRF_K = 60  # Reciprocal rank fusion constant
+MAX_BATCH_QUESTIONS = 100  # Questions accepted by /api/answer-questions per request
+OLLAMA_CONCURRENCY = int(os.environ.get('STUDYMATE_OLLAMA_CONCURRENCY', 2))  # Parallel generations per batch or quiz request
+QUIZ_SECTION_CHUNKS = 4  # Chunks per quiz section (~1k tokens of document text per prompt)
+QUIZ_QUESTIONS_PER_SECTION = 2  # Questions asked of each section; more sections spread coverage further
+QUIZ_MAX_ROUNDS = 3  # Generation rounds to make up for malformed or duplicate questions
+QUIZ_DUPLICATE_SIMILARITY = 0.9  # Cosine similarity above which two questions count as the same
+OLLAMA_NUM_CTX = 4096
+OLLAMA_NUM_PREDICT = 1000  # Increased for quiz generation
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('STUDYMATE_CONTEXT_TOKENS', 1024))  # Retrieved context per answer prompt
+TOKEN_ESTIMATE_HEADROOM = 1.15  # Counts come from the embedding tokenizer, which only approximates the LLM's
+MIN_PARTIAL_CHUNK_TOKENS = 32  # Smallest truncated chunk worth adding to fill the budget
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_QUANTIZATION = os.environ.get('STUDYMATE_EMBEDDING_QUANTIZATION', 'none').lower()  # 'int8' for dynamic quantization on CPU
+DATA_DIR = os.environ.get('STUDYMATE_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+# Embeddings model, loaded on first use
 embeddings = None
-try:
-    embeddings = SentenceTransformer('all-MiniLM-L6-v2')
-    logger.info("✅ Sentence Transformers initialized successfully")
-except Exception as e:
-    logger.error(f"❌ Embedding initialization failed: {str(e)}")
-    raise
-# Store processed documents in memory with FAISS indices
-document_store = {}
-quiz_store = {}
+embeddings_lock = threading.Lock()
+def load_embedding_model():
+    """Load the sentence-transformer model, dynamically quantized to int8 if configured"""
+    from sentence_transformers import SentenceTransformer
+    try:
+        if EMBEDDING_QUANTIZATION == 'int8':
+            import torch
+            # Linear layers get int8 weights and activations quantized on the fly; CPU only
+            model = SentenceTransformer(EMBEDDING_MODEL_NAME, device='cpu')
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        logger.info(f"✅ Sentence Transformers initialized successfully (quantization: {EMBEDDING_QUANTIZATION})")
+        return model
+    except Exception as e:
+        logger.error(f"❌ Embedding initialization failed: {str(e)}")
+        raise
+def get_embeddings():
+    """Return the embeddings model, loading it on the first call"""
+    global embeddings
+    if embeddings is None:
+        with embeddings_lock:
+            if embeddings is None:
+                embeddings = load_embedding_model()
+    return embeddings
+upload_folder_lock = threading.Lock()
+def get_upload_folder():
+    """Return the temporary upload directory, creating it on first use.
+    Not created at import: spawned PDF workers import this module too and would each leak one."""
+    with upload_folder_lock:
+        if 'UPLOAD_FOLDER' not in app.config:
+            app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        return app.config['UPLOAD_FOLDER']
+# All encode calls go through one batcher so concurrent requests share forward passes
+embedding_batcher = EmbeddingBatcher(
+    get_embeddings,
+    window_seconds=EMBED_BATCH_WINDOW_MS / 1000,
+    max_batch_size=EMBED_MAX_BATCH_SIZE,
+    encode_batch_size=EMBED_BATCH_SIZE
+)
+def estimate_document_size(doc):
+    """Approximate in-memory size of a document: index vectors plus chunk and cleaned text"""
+    # getsizeof, not len: CPython stores non-Latin-1 text at 2-4 bytes per character
+    size = sys.getsizeof(doc['cleaned_text'])
+    if doc.get('chunks') is not None:
+        size += doc['chunks'].nbytes
+    if doc.get('bm25') is not None:
+        size += doc['bm25'].nbytes
+    index = doc.get('index')
+    if index is not None:
+        size += estimate_index_bytes(index)
+        if doc.get('doc_id') in corpus_index:
+            # Plus the copy held by the shared corpus index
+            size += index.ntotal * corpus_index.code_size(index.d)
+    return size
+# Shared index for questions spanning several sources. It holds a second copy of each member document's
+# vectors (float32, or fp16 when compression is on, so compressed per-document indexes save less for them),
+# so documents only join it when a multi-document question first uses them
+corpus_index = CorpusIndex('Flat' if INDEX_COMPRESSION == 'none' else 'SQfp16')
+# Store processed documents in memory with FAISS indices, keyed by content hash
+document_store = BoundedCache(
+    "document",
+    DOCUMENT_CACHE_MAX_BYTES,
+    DOCUMENT_CACHE_TTL,
+    sizeof=estimate_document_size,
+    on_evict=lambda doc_id, doc: corpus_index.remove(doc_id)
+)
+document_store_lock = threading.Lock()
+ingest_locks = {}
+document_storage = DocumentStorage(DATA_DIR)
+quiz_store = BoundedCache("quiz", QUIZ_CACHE_MAX_BYTES, QUIZ_CACHE_TTL)
+# (client session, source) -> chunks already in the prompt and Ollama's context tokens, for follow-up questions
+prompt_sessions = BoundedCache(
+    "prompt session",
+    PROMPT_SESSION_MAX_BYTES,
+    PROMPT_SESSION_TTL,
+    sizeof=lambda session: 8 * len(session["context"]) + sum(sys.getsizeof(chunk) for chunk in session["chunks"])
+)
+# Generated answers per document, matched on question similarity
+answer_cache = SemanticAnswerCache(threshold=ANSWER_CACHE_THRESHOLD)
+# Normalised query text -> embedding, shared by every retrieval path
+query_embedding_cache = BoundedCache(
+    "query embedding",
+    QUERY_CACHE_MAX_BYTES,
+    sizeof=lambda vector: vector.nbytes
+)
+# One pooled keep-alive client for every Ollama call
+ollama = OllamaClient(
+    OLLAMA_BASE_URL,
+    OLLAMA_MODEL,
+    pool_size=OLLAMA_POOL_SIZE,
+    connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+    read_timeout=OLLAMA_READ_TIMEOUT,
+    keep_alive=OLLAMA_KEEP_ALIVE
+)
+# Readiness is probed in the background; requests only read the cached state. The probe thread starts
+# with the server or on first use, not at import, since PDF worker processes re-import this module
+ollama_monitor = OllamaMonitor(
+    ollama,
+    OLLAMA_MODEL,
+    up_interval=OLLAMA_MONITOR_INTERVAL,
+    down_interval=OLLAMA_MONITOR_DOWN_INTERVAL
+)
+# Every generation waits here for a slot, interactive Q&A ahead of quizzes and study plans
+llm_scheduler = LLMScheduler(max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE, queue_timeout=LLM_QUEUE_TIMEOUT)
 @app.route('/', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -45,33 +218,33 @@ def health_check():
         "message": "StudyMate Flask API is running",
         "timestamp": datetime.now().isoformat()
     })
-def initialize_ollama():
-    """Initialize and check Ollama connection"""
-    try:
-        logger.info("🔄 Checking Ollama connection...")
-        response = requests.get("http://localhost:11434/api/tags", timeout=10)
-        if response.status_code != 200:
-            error_msg = f"Ollama server not responding. Status: {response.status_code}"
-            logger.error(f"❌ {error_msg}")
-            raise ValueError(error_msg)
-        models_data = response.json()
-        models = models_data.get("models", [])
-        model_names = [m["name"] for m in models]
-        logger.info(f"📋 Available models: {model_names}")
-        if OLLAMA_MODEL not in model_names:
-            error_msg = f"Model '{OLLAMA_MODEL}' not found. Available: {model_names}"
-            logger.error(f"❌ {error_msg}")
-            raise ValueError(error_msg)
-        logger.info(f"✅ Ollama initialized successfully with model: {OLLAMA_MODEL}")
-        return True
-    except requests.exceptions.ConnectionError:
-        error_msg = "Cannot connect to Ollama server. Please start it with 'ollama serve'"
-        logger.error(f"❌ {error_msg}")
-        raise ValueError(error_msg)
-    except Exception as e:
-        error_msg = f"Failed to initialize Ollama: {str(e)}"
-        logger.error(f"❌ {error_msg}")
-        raise ValueError(error_msg)
+def require_ollama():
+    """Fail fast with OllamaUnavailable if the background monitor last saw Ollama down or without the model"""
+    ollama_monitor.start().check()
+def ollama_unavailable_response(request_id, error):
+    """503 response telling the client when to retry"""
+    logger.warning(f"⚠ [{request_id}] Ollama unavailable: {str(error)}")
+    response = jsonify({
+        "error": str(error),
+        "request_id": request_id,
+        "details": "The language model server is not ready"
+    })
+    response.status_code = 503
+    if error.retry_after:
+        response.headers['Retry-After'] = str(int(error.retry_after))
+    return response
+def queue_full_response(request_id, error):
+    """429 response with the scheduler's Retry-After estimate"""
+    logger.warning(f"⚠ [{request_id}] {str(error)}; retry after {error.retry_after}s")
+    response = jsonify({
+        "error": str(error),
+        "request_id": request_id,
+        "retry_after": error.retry_after,
+        "details": "The server is busy generating other answers; please retry shortly"
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(int(error.retry_after))
+    return response
 def get_video_id(url):
     """Extract the video ID from a YouTube URL"""
     try:
@@ -91,7 +264,7 @@ def extract_text_from_youtube(url):
         logger.info(f"🎥 Extracting transcript from YouTube URL: {url}")
         video_id = get_video_id(url)
         # Create instance of API
-        ytt_api = YouTubeTranscriptApi()
+        ytt_api = youtube_transcript_api.YouTubeTranscriptApi()
         # Fetch transcript (with language priority)
         fetched_transcript = ytt_api.fetch(video_id, languages=['en'])
         # Convert transcript object to raw data
@@ -104,17 +277,50 @@ def extract_text_from_youtube(url):
         error_msg = f"Error extracting YouTube transcript: {str(e)}"
         logger.error(f"❌ {error_msg}")
         raise ValueError(error_msg)
-def extract_text_from_pdf(file_path):
-    """Extract text from PDF with better error handling"""
+def iter_pdf_pages(file_path, parallel=None, workers=None):
+    """Yield page texts in order, sharding the page range across a process pool for large files"""
+    doc = fitz.open(file_path)
+    page_count = len(doc)
+    doc.close()
+    workers = workers or PDF_EXTRACT_WORKERS
+    if parallel is None:
+        parallel = workers > 1 and page_count >= PDF_PARALLEL_MIN_PAGES
+    if not parallel:
+        doc = fitz.open(file_path)
+        try:
+            for page_num in range(page_count):
+                yield f"\n--- Page {page_num + 1} ---\n{doc[page_num].get_text()}"
+        finally:
+            doc.close()
+        return
+    # Several small shards per worker so uneven pages still balance across the pool
+    shard_count = min(page_count, max(workers * 4, -(-page_count // PDF_SHARD_MAX_PAGES)))
+    bounds = [page_count * i // shard_count for i in range(shard_count + 1)]
+    shards = zip(bounds[:-1], bounds[1:])
+    pool = get_pdf_pool(workers)
+    # Only a bounded window of shards is in flight, so extracted text can't pile up ahead of
+    # a slow consumer; the next shard is submitted as each one is yielded, in page order
+    in_flight = deque()
+    try:
+        for start, end in islice(shards, workers * PDF_INFLIGHT_SHARDS_PER_WORKER):
+            in_flight.append(pool.submit(extract_pdf_pages, file_path, start, end))
+        while in_flight:
+            shard = in_flight.popleft().result()
+            for start, end in islice(shards, 1):
+                in_flight.append(pool.submit(extract_pdf_pages, file_path, start, end))
+            yield from shard
+    except BrokenProcessPool:
+        discard_pdf_pool(workers, pool)
+        raise
+    finally:
+        for future in in_flight:
+            future.cancel()
+    logger.info(f"⚡ Extracted {page_count} pages with {workers} worker processes")
+def extract_text_from_pdf(file_path, parallel=None, workers=None):
+    """Extract text from PDF, sharding the page range across a process pool for large files"""
     try:
         logger.info(f"📄 Extracting text from PDF: {file_path}")
-        doc = fitz.open(file_path)
-        text = ""
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            page_text = page.get_text()
-            text += f"\n--- Page {page_num + 1} ---\n{page_text}"
-        doc.close()
+        text = "".join(iter_pdf_pages(file_path, parallel=parallel, workers=workers))
         logger.info(f"✅ Extracted {len(text)} characters from PDF")
         return text
     except Exception as e:
@@ -125,8 +331,8 @@ def transcribe_audio(file_path):
     """Transcribe audio with better error handling"""
     try:
         logger.info(f"🎵 Transcribing audio: {file_path}")
-        audio = AudioSegment.from_file(file_path)
-        wav_path = os.path.join(app.config['UPLOAD_FOLDER'], f"temp_audio_{datetime.now().timestamp()}.wav")
+        audio = pydub.AudioSegment.from_file(file_path)
+        wav_path = os.path.join(get_upload_folder(), f"temp_audio_{datetime.now().timestamp()}.wav")
         audio = audio.normalize()
         audio.export(wav_path, format="wav")
         recognizer = sr.Recognizer()
@@ -164,88 +370,583 @@ def clean_text(text):
     text = re.sub(r'[^\w\s\.\,\!\?\;\:\-$$      $$]', ' ', text)
     text = re.sub(r'--- Page \d+ ---', '', text)
     return text
-def chunk_text(text, chunk_size=300, overlap=50):
-    """Create overlapping chunks for better context preservation"""
+SENTENCE_END_PATTERN = re.compile(r'[.!?]+')
+# Separate tokenizer instance for counting, loaded on first use
+token_counter = None
+token_counter_lock = threading.Lock()
+def get_token_counter():
+    """Return a private copy of the embedding model's tokenizer, or None if it has none; call with token_counter_lock held.
+    The model's own instance is reconfigured (truncation to 256 tokens) by every encode on the batcher thread,
+    so counting with it from other threads can come back capped."""
+    global token_counter
+    if token_counter is None:
+        tokenizer = getattr(get_embeddings(), 'tokenizer', None)
+        if tokenizer is None:
+            token_counter = False
+        else:
+            from transformers import AutoTokenizer
+            token_counter = AutoTokenizer.from_pretrained(tokenizer.name_or_path)
+    return token_counter or None
+def count_tokens(texts):
+    """Count embedding-model tokens for a batch of texts, falling back to whitespace words"""
+    with token_counter_lock:
+        tokenizer = get_token_counter()
+        if tokenizer is None:
+            return [len(text.split()) for text in texts]
+        return [len(ids) for ids in tokenizer(texts, add_special_tokens=False, truncation=False)['input_ids']]
+def split_long_sentence(text, max_tokens):
+    """Split a sentence into consecutive (start, end, tokens) pieces of at most max_tokens tokens"""
+    with token_counter_lock:
+        tokenizer = get_token_counter()
+        if tokenizer is not None and getattr(tokenizer, 'is_fast', False):
+            offsets = tokenizer(text, add_special_tokens=False, truncation=False, return_offsets_mapping=True)['offset_mapping']
+        else:
+            offsets = [match.span() for match in re.finditer(r'\S+', text)]
+    pieces = []
+    for i in range(0, len(offsets), max_tokens):
+        window = offsets[i:i + max_tokens]
+        pieces.append((window[0][0], window[-1][1], len(window)))
+    return pieces
+def iter_sentence_spans(segments, max_tokens=CHUNK_SIZE_TOKENS):
+    """Yield (start, end, tokens, span_text) for each sentence in a stream of segments joined by single spaces.
+    Offsets index into the joined text. span_text runs from the end of the previous sentence, so
+    concatenating consecutive span_texts reproduces the joined text between their offsets.
+    Each character is scanned once; sentences over max_tokens are split on token boundaries."""
+    tail = ""  # Text after the last sentence end, never containing a terminator
+    tail_start = 0
+    base = 0
+    pending = []
+    def flush():
+        sentences = [span_text[len(span_text) - (end - start):] for start, end, span_text in pending]
+        for (start, end, span_text), sentence, tokens in zip(pending, sentences, count_tokens(sentences)):
+            if tokens <= max_tokens:
+                yield start, end, tokens, span_text
+                continue
+            lead = len(span_text) - len(sentence)
+            previous_end = 0
+            for piece_start, piece_end, piece_tokens in split_long_sentence(sentence, max_tokens):
+                piece_text = span_text[:lead + piece_end] if previous_end == 0 else sentence[previous_end:piece_end]
+                yield start + piece_start, start + piece_end, piece_tokens, piece_text
+                previous_end = piece_end
+        pending.clear()
+    for segment_num, segment in enumerate(segments):
+        piece = f" {segment}" if segment_num else segment
+        position = 0
+        for match in SENTENCE_END_PATTERN.finditer(piece):
+            span_text = tail + piece[position:match.end()]
+            sentence = span_text.lstrip(' .!?')
+            # A bare run of terminators is not a sentence; keep it as a gap before the next one
+            if sentence[:-len(match.group())].strip():
+                end = base + match.end()
+                pending.append((end - len(sentence), end, span_text))
+                tail = ""
+                tail_start = end
+            else:
+                tail = span_text
+            position = match.end()
+            if len(pending) >= TOKEN_COUNT_BATCH:
+                yield from flush()
+        tail += piece[position:]
+        base += len(piece)
+        if pending:
+            yield from flush()
+    sentence = tail.strip(' .!?')
+    if sentence.strip():
+        end = tail_start + len(tail.rstrip())
+        pending.append((end - len(tail.lstrip(' .!?').rstrip()), end, tail.rstrip()))
+        yield from flush()
+def iter_chunk_spans(sentences, chunk_size=CHUNK_SIZE_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """Yield (start, end, text) chunks of at most chunk_size tokens from sentence spans, carrying
+    trailing sentences worth up to overlap tokens into the next chunk. Runs in linear time."""
+    window = deque()
+    window_tokens = 0
+    def chunk():
+        start, end, _, span_text = window[0]
+        text = span_text[len(span_text) - (end - start):] + "".join(s[3] for s in islice(window, 1, None))
+        return start, window[-1][1], text
+    for sentence in sentences:
+        tokens = sentence[2]
+        if window and window_tokens + tokens > chunk_size:
+            yield chunk()
+            kept_tokens = 0
+            keep = 0
+            for kept in reversed(window):
+                if kept_tokens + kept[2] > overlap:
+                    break
+                kept_tokens += kept[2]
+                keep += 1
+            while len(window) > keep or (window and window_tokens + tokens > chunk_size):
+                window_tokens -= window.popleft()[2]
+        window.append(sentence)
+        window_tokens += tokens
+    if window:
+        yield chunk()
+def chunk_spans(text, chunk_size=CHUNK_SIZE_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """Return (start, end) character offsets of overlapping, token-bounded chunks of text"""
     if not text:
         return []
-    sentences = re.split(r'[.!?]+', text)
-    sentences = [s.strip() for s in sentences if s.strip()]
-    chunks = []
-    current_chunk = ""
-    for sentence in sentences:
-        if len(current_chunk.split()) + len(sentence.split()) > chunk_size and current_chunk:
-            chunks.append(current_chunk.strip())
-            words = current_chunk.split()
-            if len(words) > overlap:
-                current_chunk = " ".join(words[-overlap:]) + " " + sentence
-            else:
-                current_chunk = sentence
-        else:
-            current_chunk += " " + sentence if current_chunk else sentence
-    if current_chunk.strip():
-        chunks.append(current_chunk.strip())
+    return [(start, end) for start, end, _ in iter_chunk_spans(iter_sentence_spans([text], chunk_size), chunk_size, overlap)]
+def chunk_text(text, chunk_size=CHUNK_SIZE_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """Create overlapping chunks for better context preservation"""
+    chunks = [text[start:end] for start, end in chunk_spans(text, chunk_size, overlap)]
     logger.info(f"✅ Created {len(chunks)} text chunks")
     return chunks
-def create_faiss_index(chunks):
-    """Create FAISS index with error handling"""
-    if not chunks:
+def iter_batches(items, batch_size):
+    """Group an iterable into lists of at most batch_size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+def embed_chunk_stream(chunk_stream):
+    """Embed (start, end, text) chunks in bounded batches on this thread while a producer thread keeps
+    extracting and chunking. Returns (vectors, starts, ends); vectors is None when there are no chunks."""
+    batches = queue.Queue(maxsize=PIPELINE_QUEUE_BATCHES)
+    stop = threading.Event()
+    done = object()
+    def put(item):
+        # Give up once the consumer has stopped so the producer never blocks forever
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    def produce():
+        try:
+            for item in iter_batches(chunk_stream, EMBED_BATCH_SIZE):
+                if not put(item):
+                    return
+            put(done)
+        except Exception as e:
+            put(e)
+    producer = threading.Thread(target=produce, name="ingest-producer", daemon=True)
+    producer.start()
+    vector_batches = []
+    starts = []
+    ends = []
+    try:
+        while True:
+            item = batches.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            vector_batches.append(embedding_batcher.encode([text for _, _, text in item]))
+            starts.extend(start for start, _, _ in item)
+            ends.extend(end for _, end, _ in item)
+    finally:
+        stop.set()
+        producer.join()
+    vectors = np.vstack(vector_batches) if vector_batches else None
+    return vectors, np.array(starts, dtype=np.int32), np.array(ends, dtype=np.int32)
+COMPRESSION_CODECS = {'none': 'Flat', 'fp16': 'SQfp16', 'sq8': 'SQ8', 'pq': f'PQ{PQ_SUBQUANTIZERS}'}
+RERANK_SUFFIXES = {'none': '', 'flat': ',RFlat', 'fp16': ',Refine(SQfp16)'}
+def index_description(count, compression=None, rerank=None):
+    """FAISS index_factory string for a document of count chunks.
+    Small documents get exact flat search; larger ones HNSW or IVF (STUDYMATE_ANN_INDEX). Vectors are
+    stored as configured by STUDYMATE_INDEX_COMPRESSION, optionally re-ranked with finer vectors."""
+    compression = compression or INDEX_COMPRESSION
+    rerank = rerank or INDEX_RERANK
+    codec = COMPRESSION_CODECS.get(compression, 'Flat')
+    if compression == 'pq' and count < PQ_MIN_TRAIN_VECTORS:
+        codec = 'SQ8'
+    if count <= FLAT_INDEX_MAX_VECTORS:
+        description = codec
+    # FAISS's HNSW+PQ only supports L2, so PQ always goes through IVF
+    elif ANN_INDEX_TYPE == 'ivf' or codec.startswith('PQ'):
+        # Keep at least 39 training points per coarse centroid, as FAISS recommends
+        description = f"IVF{min(int(4 * np.sqrt(count)), count // 39)},{codec}"
+    else:
+        description = f"HNSW{HNSW_M},{codec}"
+    if codec != 'Flat':
+        description += RERANK_SUFFIXES.get(rerank, '')
+    return description
+def create_faiss_index(vectors, compression=None, rerank=None):
+    """Create an inner-product FAISS index over normalised chunk embeddings, picking the index type by size"""
+    if vectors is None or len(vectors) == 0:
         raise ValueError("No text chunks available to index")
     try:
-        logger.info(f"🔄 Creating FAISS index for {len(chunks)} chunks...")
-        if embeddings is None:
-            raise ValueError("Embeddings model not initialized")
-        embeddings_array = embeddings.encode(
-            chunks,
-            convert_to_numpy=True,
-            show_progress_bar=False,
-            batch_size=32
-        )
-        dimension = embeddings_array.shape[1]
-        index = faiss.IndexFlatL2(dimension)
-        index.add(embeddings_array.astype('float32'))
-        logger.info(f"✅ FAISS index created successfully with {index.ntotal} vectors")
-        return index, chunks
+        count, dimension = vectors.shape
+        description = index_description(count, compression, rerank)
+        logger.info(f"🔄 Creating FAISS index '{description}' for {count} chunks...")
+        index = faiss.index_factory(dimension, description, faiss.METRIC_INNER_PRODUCT)
+        hnsw = find_hnsw(index)
+        if hnsw is not None:
+            hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        if not index.is_trained:
+            index.train(vectors)
+        index.add(vectors)
+        # Built now, before the index is shared, so retrieval never mutates it mid-query
+        enable_reconstruction(index)
+        logger.info(f"✅ FAISS {type(index).__name__} created successfully with {index.ntotal} vectors")
+        return index
     except Exception as e:
         error_msg = f"Error creating FAISS index: {str(e)}"
         logger.error(f"❌ {error_msg}")
         raise ValueError(error_msg)
-def retrieve_chunks(query, index, chunks, k=5):
-    """Retrieve most relevant chunks with better scoring"""
+def find_hnsw(index):
+    """Return the HNSW graph of an index (looking through a re-ranking wrapper), or None"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexRefine):
+        index = faiss.downcast_index(index.base_index)
+    return index.hnsw if isinstance(index, faiss.IndexHNSW) else None
+def configure_search(index, k):
+    """Apply the approximate-search knobs (efSearch / nprobe / re-rank depth) before querying an index"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexRefine):
+        index.k_factor = RERANK_K_FACTOR
+    hnsw = find_hnsw(index)
+    if hnsw is not None:
+        hnsw.efSearch = max(HNSW_EF_SEARCH, k * RERANK_K_FACTOR)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = IVF_NPROBE
+def estimate_index_bytes(index):
+    """Approximate memory held by a FAISS index's codes, graph links and re-ranking vectors"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexRefine):
+        return estimate_index_bytes(index.base_index) + estimate_index_bytes(index.refine_index)
+    if isinstance(index, faiss.IndexHNSW):
+        return estimate_index_bytes(index.storage) + index.ntotal * HNSW_M * 2 * 4
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return ivf.ntotal * (ivf.code_size + 8) + ivf.nlist * ivf.d * 4
+    return index.ntotal * getattr(index, 'code_size', index.d * 4)
+def build_index(cleaned_segments):
+    """Chunk and embed a stream of cleaned segments, returning (index, starts, ends, bm25).
+    The BM25 inverted index is filled on the producer thread as chunks are cut."""
+    bm25 = BM25Index()
+    chunk_stream = bm25.indexing(iter_chunk_spans(iter_sentence_spans(cleaned_segments)))
+    vectors, starts, ends = embed_chunk_stream(chunk_stream)
+    index = create_faiss_index(vectors) if vectors is not None else None
+    return index, starts, ends, bm25.finalize()
+def ingest_segments(segments):
+    """Stream raw text segments through clean → chunk → embed, returning (cleaned_text, index, chunks, bm25)"""
+    cleaned_parts = []
+    def cleaned_segments():
+        for segment in segments:
+            cleaned = clean_text(segment)
+            if cleaned:
+                cleaned_parts.append(cleaned)
+                yield cleaned
+    index, starts, ends, bm25 = build_index(cleaned_segments())
+    # Chunk offsets index into the segments joined by single spaces, exactly as iter_sentence_spans sees them
+    cleaned_text = " ".join(cleaned_parts)
+    logger.info(f"✅ Ingested {len(starts)} chunks from {len(cleaned_parts)} segments")
+    return cleaned_text, index, ChunkList(cleaned_text, starts, ends), bm25
+def normalize_query(query):
+    """Canonical cache key for a query; the MiniLM tokenizer is uncased, so case doesn't change the embedding"""
+    return " ".join(query.lower().split())
+def embed_queries(queries):
+    """Embed queries as an (n, dimension) array in one encode call, reusing cached embeddings of repeated questions"""
+    keys = [normalize_query(query) for query in queries]
+    vectors = [query_embedding_cache.get(key) for key in keys]
+    missing = {}
+    for i, vector in enumerate(vectors):
+        if vector is None:
+            missing.setdefault(keys[i], []).append(i)
+    if missing:
+        encoded = embedding_batcher.encode([queries[positions[0]] for positions in missing.values()])
+        for (key, positions), vector in zip(missing.items(), encoded):
+            vector = query_embedding_cache.put(key, vector[np.newaxis].copy())
+            for i in positions:
+                vectors[i] = vector
+    return np.vstack(vectors)
+def embed_query(query):
+    """Embed a query as a (1, dimension) array, reusing cached embeddings of repeated questions"""
+    return embed_queries([query])
+def retrieve_chunks(query, index, chunks, k=5, bm25=None):
+    """Retrieve most relevant chunks with better scoring.
+    With a BM25 index, dense and lexical candidates are merged by reciprocal rank fusion."""
+    return retrieve_chunks_batch([query], index, chunks, k, bm25)[0]
+def mmr_order(relevance, vectors, count, diversity=MMR_LAMBDA):
+    """Pick up to count candidates by Maximal Marginal Relevance and return their positions in pick order.
+    relevance is each candidate's score for the query; vectors are their normalised embeddings."""
+    relevance = np.asarray(relevance, dtype='float32')
+    similarity = vectors @ vectors.T
+    redundancy = np.zeros(len(relevance), dtype='float32')
+    available = np.ones(len(relevance), dtype=bool)
+    order = []
+    for _ in range(min(count, len(relevance))):
+        scores = np.where(available, diversity * relevance - (1 - diversity) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        order.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return order
+def retrieve_chunks_batch(queries, index, chunks, k=5, bm25=None, query_embeddings=None):
+    """Retrieve the most relevant chunks for several queries with one batched index search.
+    Candidates are re-ordered by MMR so near-duplicate chunks don't crowd out other passages.
+    Returns one list of chunks per query."""
     if index is None or not chunks:
         logger.warning("⚠ No index or chunks available for retrieval")
-        return []
+        return [[] for _ in queries]
     try:
-        logger.info(f"🔍 Searching for relevant chunks for query: '{query[:50]}...'")
-        query_embedding = embeddings.encode([query], convert_to_numpy=True)
-        k = min(k, len(chunks))
-        distances, indices = index.search(query_embedding.astype('float32'), k)
-        retrieved_chunks = []
-        for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < len(chunks):
-                similarity_score = 1 / (1 + distance)
-                retrieved_chunks.append({
-                    'text': chunks[idx],
-                    'score': similarity_score,
-                    'rank': i + 1
-                })
-        retrieved_chunks.sort(key=lambda x: x['score'], reverse=True)
-        logger.info(f"✅ Retrieved {len(retrieved_chunks)} relevant chunks")
-        return [chunk['text'] for chunk in retrieved_chunks]
+        logger.info(f"🔍 Searching for relevant chunks for {len(queries)} queries, first: '{queries[0][:50]}...'")
+        if query_embeddings is None:
+            query_embeddings = embed_queries(queries)
+        # A wider candidate pool than k gives MMR room to skip redundant chunks
+        candidates = min(max(k, HYBRID_CANDIDATES), len(chunks))
+        configure_search(index, candidates)
+        # Embeddings are normalised, so inner-product scores are cosine similarities
+        similarities, indices = index.search(query_embeddings, candidates)
+        results = []
+        for query, query_embedding, row_similarities, row in zip(queries, query_embeddings, similarities, indices):
+            dense = {int(idx): float(score) for idx, score in zip(row, row_similarities) if 0 <= idx < len(chunks)}
+            if bm25 is None:
+                relevance = dense
+            else:
+                # Exact terms (acronyms, formula names, section numbers) that dense search misses rank via BM25
+                lexical_ranking = [idx for idx, _ in bm25.search(query, candidates)]
+                fused = {}
+                for ranking in (list(dense), lexical_ranking):
+                    for rank, idx in enumerate(ranking):
+                        fused[idx] = fused.get(idx, 0.0) + 1.0 / (RRF_K + rank + 1)
+                top = max(fused.values(), default=1.0)
+                relevance = {idx: score / top for idx, score in fused.items()}
+            candidate_ids = sorted(relevance, key=relevance.get, reverse=True)[:candidates]
+            vectors = index_vectors(index, candidate_ids)
+            order = mmr_order([relevance[idx] for idx in candidate_ids], vectors, k)
+            results.append([chunks[candidate_ids[i]] for i in order])
+        logger.info(f"✅ Retrieved {sum(len(r) for r in results)} relevant chunks for {len(queries)} queries")
+        return results
     except Exception as e:
         error_msg = f"Error retrieving chunks: {str(e)}"
         logger.error(f"❌ {error_msg}")
+        return [[] for _ in queries]
+def retrieve_corpus_chunks(query, doc_ids=None, k=5):
+    """Retrieve the most relevant chunks across all documents in the corpus, or only doc_ids, in one search.
+    Returns (text, doc_id) pairs, best first."""
+    try:
+        logger.info(f"🔍 Searching the corpus for query: '{query[:50]}...'")
+        query_embedding = embed_query(query)
+        hits = corpus_index.search(query_embedding, max(k, HYBRID_CANDIDATES), doc_ids=doc_ids)[0]
+        if hits:
+            order = mmr_order([score for _, _, score in hits], corpus_index.vectors(hits), k)
+            hits = [hits[i] for i in order]
+        retrieved_chunks = []
+        for doc_id, chunk_number, _ in hits:
+            doc = get_document(doc_id)
+            if doc is not None and doc['chunks'] is not None and chunk_number < len(doc['chunks']):
+                retrieved_chunks.append((doc['chunks'][chunk_number], doc_id))
+        logger.info(f"✅ Retrieved {len(retrieved_chunks)} relevant chunks from the corpus")
+        return retrieved_chunks
+    except Exception as e:
+        error_msg = f"Error retrieving corpus chunks: {str(e)}"
+        logger.error(f"❌ {error_msg}")
         return []
-def construct_prompt(query, retrieved_chunks):
-    """Construct a better prompt for RAG"""
+def hash_file(file_path, block_size=1024 * 1024):
+    """Compute the SHA-256 hex digest of a file without loading it into memory"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+def add_to_corpus(doc):
+    """Add a cached, indexed document's vectors to the shared corpus index, if not already there.
+    The vectors are copied outside the document cache lock; a document evicted meanwhile is taken out again."""
+    doc_id = doc['doc_id']
+    if doc['index'] is None or doc_id in corpus_index:
+        return
+    corpus_index.add(doc_id, index_vectors(doc['index']))
+    # Re-measure so the cache accounts for the corpus copy
+    if not document_store.refresh(doc_id, doc):
+        corpus_index.remove(doc_id)
+def get_document(doc_id):
+    """Look up a document in memory, falling back to the on-disk store"""
+    doc = document_store.get(doc_id)
+    if doc is not None:
+        return doc
+    doc = document_storage.load(doc_id)
+    if doc is None:
+        return None
+    doc['index_lock'] = threading.Lock()
+    if doc['index'] is not None and doc['index'].metric_type != faiss.METRIC_INNER_PRODUCT:
+        # Persisted before embeddings were normalised; rebuild on first use
+        doc['index'] = None
+        doc['chunks'] = None
+    if doc['index'] is not None:
+        with doc['index_lock']:
+            # Indexes persisted without a direct map get one before any query can reach them
+            enable_reconstruction(doc['index'])
+    return document_store.setdefault(doc_id, doc)
+def load_document(doc_id, source_name, source_type, extract_segments):
+    """Return the cached document for doc_id, streaming extract_segments() through ingestion only on a cache miss"""
+    doc = get_document(doc_id)
+    if doc is not None:
+        logger.info(f"♻ Document cache hit for {doc_id[:16]}")
+        return doc
+    with document_store_lock:
+        ingest_lock = ingest_locks.setdefault(doc_id, threading.Lock())
+    # Serialize ingestion per document so concurrent uploads of the same source extract once
+    with ingest_lock:
+        doc = get_document(doc_id)
+        if doc is not None:
+            logger.info(f"♻ Document cache hit for {doc_id[:16]}")
+            return doc
+        try:
+            logger.info(f"🔄 Document cache miss for {doc_id[:16]}, ingesting source...")
+            cleaned_text, index, chunks, bm25 = ingest_segments(extract_segments())
+            if len(cleaned_text) < 10:
+                return None
+            doc = {
+                'doc_id': doc_id,
+                'source_name': source_name,
+                'source_type': source_type,
+                'cleaned_text': cleaned_text,
+                'chunks': chunks,
+                'index': index,
+                'bm25': bm25,
+                'index_lock': threading.Lock(),
+                'timestamp': datetime.now().isoformat()
+            }
+            document_store.put(doc_id, doc)
+            try:
+                document_storage.save_text(doc)
+                if index is not None:
+                    document_storage.save_index(doc)
+            except Exception as e:
+                logger.warning(f"⚠ Failed to persist document {doc_id[:16]}: {e}")
+            return doc
+        finally:
+            with document_store_lock:
+                ingest_locks.pop(doc_id, None)
+def ensure_document_index(doc):
+    """Return (index, chunks) for a document, rebuilding the index if only its text was persisted"""
+    with doc['index_lock']:
+        if doc['index'] is None:
+            index, starts, ends, bm25 = build_index([doc['cleaned_text']])
+            if index is None:
+                return None, []
+            doc['index'] = index
+            doc['chunks'] = ChunkList(doc['cleaned_text'], starts, ends)
+            doc['bm25'] = bm25
+            # Re-insert so the cache accounts for the index and chunk sizes
+            document_store.put(doc['doc_id'], doc)
+            try:
+                document_storage.save_index(doc)
+            except Exception as e:
+                logger.warning(f"⚠ Failed to persist index for {doc['doc_id'][:16]}: {e}")
+        elif doc.get('bm25') is None:
+            # Loaded from disk: rebuild the inverted index from the stored chunks
+            doc['bm25'] = BM25Index.from_chunks(doc['chunks'])
+            document_store.put(doc['doc_id'], doc)
+        return doc['index'], doc['chunks']
+def resolve_request_document(request_id, allowed_extensions=('.pdf', '.mp3', '.wav'),
+                             invalid_type_error="Please upload a valid PDF or audio file (MP3, WAV)",
+                             allow_youtube=True):
+    """Resolve the uploaded file or YouTube URL of the current request to a cached document.
+    Returns (document, None) on success or (None, (response, status)) on a client error."""
+    doc_id = request.form.get('doc_id', '').strip()
+    if doc_id:
+        doc = get_document(doc_id)
+        if doc is None:
+            logger.warning(f"❌ [{request_id}] Unknown doc_id: {doc_id}")
+            return None, (jsonify({"error": "Unknown or expired doc_id, please upload the source again"}), 404)
+        logger.info(f"♻ [{request_id}] Using stored document {doc_id[:16]}")
+        return doc, None
+    youtube_url = request.form.get('youtube_url', '').strip() if allow_youtube else ''
+    if youtube_url:
+        logger.info(f"🎥 [{request_id}] Processing YouTube URL: {youtube_url}")
+        video_id = get_video_id(youtube_url)
+        if not video_id:
+            return None, (jsonify({"error": "Invalid YouTube URL"}), 400)
+        doc = load_document(f"youtube_{video_id}", youtube_url, "youtube",
+                            lambda: [extract_text_from_youtube(youtube_url)])
+    else:
+        if 'file' not in request.files:
+            logger.warning(f"❌ [{request_id}] No file uploaded")
+            return None, (jsonify({"error": "No file uploaded"}), 400)
+        file = request.files['file']
+        if file.filename == '':
+            logger.warning(f"❌ [{request_id}] No file selected")
+            return None, (jsonify({"error": "No file selected"}), 400)
+        if not file.filename.lower().endswith(allowed_extensions):
+            logger.warning(f"❌ [{request_id}] Invalid file type: {file.filename}")
+            return None, (jsonify({"error": invalid_type_error}), 400)
+        logger.info(f"📁 [{request_id}] Processing file: {file.filename}")
+        file_path = os.path.join(get_upload_folder(), f"{request_id}_{file.filename}")
+        file.save(file_path)
+        try:
+            def extract_segments():
+                if file.filename.lower().endswith('.pdf'):
+                    logger.info(f"📄 [{request_id}] Streaming PDF pages...")
+                    return iter_pdf_pages(file_path)
+                logger.info(f"🎵 [{request_id}] Processing audio file...")
+                return [transcribe_audio(file_path)]
+            doc = load_document(hash_file(file_path), file.filename, "file", extract_segments)
+        finally:
+            if os.path.exists(file_path):
+                try:
+                    os.remove(file_path)
+                    logger.info(f"🗑 [{request_id}] Temporary file cleaned up")
+                except Exception as e:
+                    logger.warning(f"⚠ [{request_id}] Failed to remove temporary file: {e}")
+    if doc is None:
+        logger.warning(f"❌ [{request_id}] No meaningful text extracted")
+        return None, (jsonify({"error": "No meaningful text could be extracted from the source"}), 400)
+    return doc, None
+def resolve_corpus_documents(request_id, doc_ids):
+    """Load and index the documents named in a multi-document request ('*' means every stored document).
+    Returns (documents, None) on success or (None, (response, status)) on a client error."""
+    if doc_ids == ['*']:
+        doc_ids = document_storage.list_doc_ids()
+    docs = []
+    for doc_id in doc_ids:
+        doc = get_document(doc_id)
+        if doc is None:
+            logger.warning(f"❌ [{request_id}] Unknown doc_id: {doc_id}")
+            return None, (jsonify({"error": f"Unknown or expired doc_id: {doc_id}"}), 404)
+        index, chunks = ensure_document_index(doc)
+        if chunks:
+            add_to_corpus(doc)
+            docs.append(doc)
+    if not docs:
+        return None, (jsonify({"error": "No indexed documents available"}), 400)
+    return docs, None
+def context_token_budget(query):
+    """Tokens available for retrieved context: CONTEXT_TOKEN_BUDGET, capped so the prompt plus the
+    generated answer always fit in num_ctx"""
+    overhead = count_tokens([construct_prompt(query, [])])[0]
+    available = int((OLLAMA_NUM_CTX - OLLAMA_NUM_PREDICT) / TOKEN_ESTIMATE_HEADROOM) - overhead
+    return max(0, min(CONTEXT_TOKEN_BUDGET, available))
+def pack_context(query, retrieved_chunks, budget=None):
+    """Keep the leading retrieved chunks that fit the context token budget, truncating the last one to fill it.
+    Returns a prefix of retrieved_chunks (the last entry possibly shortened)."""
+    if budget is None:
+        budget = context_token_budget(query)
+    entries = [f"[Context {i+1}]: {chunk}\n\n" for i, chunk in enumerate(retrieved_chunks)]
+    packed = []
+    used = 0
+    for chunk, entry, tokens in zip(retrieved_chunks, entries, count_tokens(entries)):
+        if used + tokens <= budget:
+            packed.append(chunk)
+            used += tokens
+            continue
+        remaining = budget - used - (tokens - count_tokens([chunk])[0])
+        if remaining >= MIN_PARTIAL_CHUNK_TOKENS:
+            partial = chunk[:split_long_sentence(chunk, remaining)[0][1]]
+            # Prefer ending on a sentence boundary if that keeps most of the piece
+            sentence_ends = [m.end() for m in SENTENCE_END_PATTERN.finditer(partial)]
+            if sentence_ends and sentence_ends[-1] > len(partial) // 2:
+                partial = partial[:sentence_ends[-1]]
+            packed.append(partial)
+        break
+    logger.info(f"📦 Packed {len(packed)} of {len(retrieved_chunks)} chunks into a {budget}-token context budget")
+    return packed
+def prompt_prefix(retrieved_chunks):
+    """Instructions and document context, the part of the prompt shared by a session's questions"""
     if retrieved_chunks:
         context = "\n\n".join([f"[Context {i+1}]: {chunk}" for i, chunk in enumerate(retrieved_chunks)])
     else:
         context = "No relevant context found in the uploaded document or video transcript."
-    prompt = f"""You are StudyMate, an intelligent assistant that helps users understand and learn from their uploaded documents or YouTube videos.
+    return f"""You are StudyMate, an intelligent assistant that helps users understand and learn from their uploaded documents or YouTube videos.
 Based on the following context from the user's document or video transcript, provide a comprehensive and accurate answer to their question. If the context doesn't contain enough information, clearly state what information is missing and provide any relevant general knowledge that might help.
-CONTEXT FROM DOCUMENT OR VIDEO:
-{context}
-USER QUESTION: {query}
 INSTRUCTIONS:
 1. Answer based primarily on the provided context
 2. Be specific and detailed in your response
@@ -253,41 +954,113 @@ INSTRUCTIONS:
 4. Use clear, educational language
 5. Organize your answer with bullet points or sections if helpful
 6. If you find contradictory information, mention it
+CONTEXT FROM DOCUMENT OR VIDEO:
+{context}
+"""
+def prompt_suffix(query, extra_chunks=(), first_context=1):
+    """The per-question part of the prompt: excerpts not already in the prefix, then the question"""
+    extra = ""
+    if extra_chunks:
+        extra = "MORE CONTEXT FROM DOCUMENT OR VIDEO:\n" + "\n\n".join(
+            [f"[Context {first_context + i}]: {chunk}" for i, chunk in enumerate(extra_chunks)]) + "\n"
+    return f"""{extra}USER QUESTION: {query}
 ANSWER:"""
-    return prompt
-def get_llm_response(prompt):
-    """Get response from Ollama with better error handling and parameters"""
-    try:
-        logger.info("🤖 Generating response from Ollama...")
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json={
-                "model": OLLAMA_MODEL,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.3,
-                    "top_p": 0.85,
-                    "top_k": 40,
-                    "num_predict": 1000,  # Increased for quiz generation
-                    "repeat_penalty": 1.1,
-                    "num_ctx": 4096
-                }
-            },
-            timeout=180
-        )
-        if response.status_code == 200:
-            result = response.json()
+def construct_prompt(query, retrieved_chunks):
+    """Construct a better prompt for RAG; pass retrieved_chunks through pack_context first.
+    Instructions and context come before the question so the prompt starts with a stable prefix."""
+    return prompt_prefix(retrieved_chunks) + prompt_suffix(query)
+def session_prompt(request_id, session_key, query, retrieved_chunks):
+    """Return (prompt, params, on_done) for a question, continuing the client's session on this source if any.
+    The first question sends the whole prompt. Follow-ups send only unseen excerpts and the question, with the
+    previous generation's context tokens, so Ollama doesn't prefill the instructions and document context again.
+    A session that would overflow num_ctx starts over. on_done(result) records the context for the next follow-up."""
+    session = prompt_sessions.get(session_key) if session_key else None
+    if session is not None and not session["context"]:
+        session = None
+    if session is not None:
+        extra = [chunk for chunk in retrieved_chunks if chunk not in session["chunks"]]
+        suffix = prompt_suffix(query, extra, len(session["chunks"]) + 1)
+        needed = len(session["context"]) + count_tokens([suffix])[0] * TOKEN_ESTIMATE_HEADROOM + OLLAMA_NUM_PREDICT
+        if needed <= OLLAMA_NUM_CTX:
+            logger.info(f"🔁 [{request_id}] Continuing prompt session ({len(session['context'])} cached tokens, {len(extra)} new chunks)")
+            chunks, prompt, params = session["chunks"] + extra, suffix, {"context": session["context"]}
+        else:
+            logger.info(f"🔁 [{request_id}] Prompt session would exceed the context window, starting over")
+            session = None
+    if session is None:
+        chunks, prompt, params = list(retrieved_chunks), construct_prompt(query, retrieved_chunks), {}
+    def on_done(result):
+        if session_key and result.get("context"):
+            prompt_sessions.put(session_key, {"chunks": chunks, "context": result["context"]})
+    return prompt, params, on_done
+OLLAMA_GENERATE_OPTIONS = {
+    "temperature": 0.3,
+    "top_p": 0.85,
+    "top_k": 40,
+    "num_predict": OLLAMA_NUM_PREDICT,
+    "repeat_penalty": 1.1,
+    "num_ctx": OLLAMA_NUM_CTX
+}
+EMPTY_RESPONSE_MESSAGE = "I apologize, but I couldn't generate a proper response. Please try rephrasing your question."
+def ollama_connection_lost(error):
+    """Mark Ollama down after a failed connection so other requests fail fast until it is back"""
+    error_msg = f"Lost connection to Ollama server at {OLLAMA_BASE_URL}: {str(error)}"
+    logger.error(f"❌ {error_msg}")
+    ollama_monitor.mark_down(error_msg)
+    return OllamaUnavailable(error_msg, retry_after=OLLAMA_MONITOR_DOWN_INTERVAL)
+def continues_session(state):
+    """True if the question follows earlier ones in the client's prompt session. The answer then depends on
+    that conversation, so it must neither be served from nor added to the per-source answer cache."""
+    return state["session_key"] is not None and prompt_sessions.get(state["session_key"]) is not None
+def start_cached_session(state):
+    """Open the client's session after a cached answer, so its follow-ups also bypass the answer cache.
+    The session has no context tokens yet, so the next question sends the full prompt."""
+    if state["session_key"] is not None:
+        prompt_sessions.put(state["session_key"], {"chunks": [], "context": []})
+def get_llm_response(prompt, priority=None, on_done=None, **params):
+    """Get response from Ollama with better error handling and parameters.
+    Waits for a scheduler slot at the given priority (Q&A by default); raises LLMQueueFull when the queue is full.
+    Extra params (e.g. format for a JSON schema, context) are passed through to Ollama, and on_done is called
+    with Ollama's response object after a successful generation."""
+    with llm_scheduler.acquire(LLM_PRIORITY_QA if priority is None else priority):
+        try:
+            logger.info("🤖 Generating response from Ollama...")
+            result = ollama.generate(prompt, options=OLLAMA_GENERATE_OPTIONS, **params)
             answer = result.get("response", "").strip()
             if not answer:
                 logger.warning("⚠ Empty response from Ollama")
-                return "I apologize, but I couldn't generate a proper response. Please try rephrasing your question."
-            logger.info(f"✅ Generated response of {len(answer)} characters")
+                return EMPTY_RESPONSE_MESSAGE
+            logger.info(f"✅ Generated response of {len(answer)} characters "
+                        f"(prefill: {result.get('prompt_eval_count', 0)} tokens in {result.get('prompt_eval_duration', 0) / 1e9:.2f}s)")
+            if on_done is not None:
+                on_done(result)
             return answer
-        else:
-            error_msg = f"Ollama API error: Status {response.status_code} - {response.text}"
+        except requests.exceptions.ConnectionError as e:
+            raise ollama_connection_lost(e)
+        except requests.exceptions.Timeout:
+            error_msg = "Request to Ollama timed out. The model might be processing a complex query."
+            logger.error(f"❌ {error_msg}")
+            raise ValueError(error_msg)
+        except Exception as e:
+            error_msg = f"Error during response generation: {str(e)}"
             logger.error(f"❌ {error_msg}")
             raise ValueError(error_msg)
+def stream_llm_response(prompt, on_done=None, **params):
+    """Yield response tokens from Ollama as they are generated.
+    The timeout applies between streamed chunks, so long answers no longer hit it.
+    Extra params are passed through to Ollama; on_done is called with the final (done) chunk."""
+    try:
+        logger.info("🤖 Streaming response from Ollama...")
+        for chunk in ollama.generate_stream(prompt, options=OLLAMA_GENERATE_OPTIONS, **params):
+            if chunk.get("response"):
+                yield chunk["response"]
+            if chunk.get("done"):
+                logger.info(f"✅ Streamed response (prefill: {chunk.get('prompt_eval_count', 0)} tokens "
+                            f"in {chunk.get('prompt_eval_duration', 0) / 1e9:.2f}s)")
+                if on_done is not None:
+                    on_done(chunk)
+    except requests.exceptions.ConnectionError as e:
+        raise ollama_connection_lost(e)
     except requests.exceptions.Timeout:
         error_msg = "Request to Ollama timed out. The model might be processing a complex query."
         logger.error(f"❌ {error_msg}")
@@ -296,100 +1069,172 @@ def get_llm_response(prompt):
         error_msg = f"Error during response generation: {str(e)}"
         logger.error(f"❌ {error_msg}")
         raise ValueError(error_msg)
-@app.route('/api/answer-question', methods=['POST'])
-def answer_question():
-    """Main endpoint for answering questions about uploaded documents or YouTube videos"""
+@app.route('/api/documents', methods=['POST'])
+def upload_document():
+    """Endpoint for ingesting a PDF, audio file or YouTube URL once and returning its doc_id"""
     request_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    logger.info(f"🚀 New request [{request_id}] received")
+    logger.info(f"🚀 New document upload request [{request_id}] received")
    
     try:
-        youtube_url = request.form.get('youtube_url', '').strip()
-        question = request.form.get('question', '').strip()
-        
-        if not question:
-            logger.warning(f"❌ [{request_id}] No question provided")
-            return jsonify({"error": "No question provided"}), 400
-        # Initialize Ollama
-        initialize_ollama()
-        # Process input based on type (file or YouTube URL)
-        source_type = "youtube" if youtube_url else "file"
-        text = ""
-        source_name = youtube_url if youtube_url else ""
-        if source_type == "file":
-            if 'file' not in request.files:
-                logger.warning(f"❌ [{request_id}] No file uploaded")
-                return jsonify({"error": "No file uploaded"}), 400
-            file = request.files['file']
-            if file.filename == '':
-                logger.warning(f"❌ [{request_id}] No file selected")
-                return jsonify({"error": "No file selected"}), 400
-            allowed_extensions = ('.pdf', '.mp3', '.wav')
-            if not file.filename.lower().endswith(allowed_extensions):
-                logger.warning(f"❌ [{request_id}] Invalid file type: {file.filename}")
-                return jsonify({"error": "Please upload a valid PDF or audio file (MP3, WAV)"}), 400
-            source_name = file.filename
-            logger.info(f"📁 [{request_id}] Processing file: {file.filename}, Question: {question[:100]}...")
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{request_id}_{file.filename}")
-            file.save(file_path)
-            try:
-                if file.filename.lower().endswith('.pdf'):
-                    logger.info(f"📄 [{request_id}] Processing PDF file...")
-                    text = extract_text_from_pdf(file_path)
-                else:
-                    logger.info(f"🎵 [{request_id}] Processing audio file...")
-                    text = transcribe_audio(file_path)
-            finally:
-                if os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                        logger.info(f"🗑 [{request_id}] Temporary file cleaned up")
-                    except Exception as e:
-                        logger.warning(f"⚠ [{request_id}] Failed to remove temporary file: {e}")
-        else:
-            logger.info(f"🎥 [{request_id}] Processing YouTube URL: {youtube_url}, Question: {question[:100]}...")
-            text = extract_text_from_youtube(youtube_url)
-        if not text or len(text.strip()) < 10:
-            logger.warning(f"❌ [{request_id}] No meaningful text extracted")
-            return jsonify({"error": "No meaningful text could be extracted from the source"}), 400
-        # Build knowledge base
-        logger.info(f"🔄 [{request_id}] Building knowledge base...")
-        cleaned_text = clean_text(text)
-        chunks = chunk_text(cleaned_text)
-        
+        doc, error_response = resolve_request_document(request_id)
+        if error_response:
+            return error_response
+        # Build the search index up front so later questions only pay for retrieval
+        index, chunks = ensure_document_index(doc)
         if not chunks:
             logger.warning(f"❌ [{request_id}] No text chunks created")
             return jsonify({"error": "Could not create text chunks from the source"}), 400
-        # Create search index
-        index, chunks = create_faiss_index(chunks)
+        logger.info(f"✅ [{request_id}] Document {doc['doc_id'][:16]} ready")
+        return jsonify({
+            "message": "Document ingested successfully",
+            "request_id": request_id,
+            "doc_id": doc['doc_id'],
+            "source_name": doc['source_name'],
+            "source_type": doc['source_type'],
+            "total_chunks": len(chunks)
+        })
+    except Exception as e:
+        error_details = traceback.format_exc()
+        logger.error(f"❌ [{request_id}] Unexpected error: {str(e)}\n{error_details}")
+        return jsonify({
+            "error": str(e),
+            "request_id": request_id,
+            "details": "Check server logs for more information"
+        }), 500
+def prepare_question(request_id):
+    """Validate the question and resolve its source(s) for answer_question and its streaming variant.
+    Returns (state, error_response); state holds the question, response fields, answer cache scope and a
+    retrieve() callable that returns the packed context chunks."""
+    question = request.form.get('question', '').strip()
+    session_id = request.form.get('session_id', '').strip()
+    
+    if not question:
+        logger.warning(f"❌ [{request_id}] No question provided")
+        return None, (jsonify({"error": "No question provided"}), 400)
+    logger.info(f"❓ [{request_id}] Question: {question[:100]}...")
+    # Several doc_ids (comma-separated or repeated, '*' for all) search the shared corpus index
+    doc_ids = [doc_id.strip() for value in request.form.getlist('doc_ids') for doc_id in value.split(',') if doc_id.strip()]
+    if doc_ids:
+        docs, error_response = resolve_corpus_documents(request_id, doc_ids)
+        if error_response:
+            return None, error_response
+        doc_info = {
+            "doc_ids": [d['doc_id'] for d in docs],
+            "source_name": ", ".join(d['source_name'] for d in docs),
+            "source_type": "corpus"
+        }
+        total_chunks = sum(len(d['chunks']) for d in docs)
+        cache_scope = ",".join(sorted(doc_info["doc_ids"]))
+        def retrieve():
+            logger.info(f"🔍 [{request_id}] Retrieving relevant information from {len(docs)} documents...")
+            hits = retrieve_corpus_chunks(question, doc_info["doc_ids"], k=RETRIEVAL_TOP_K)
+            retrieved_chunks = pack_context(question, [text for text, _ in hits])
+            doc_info["chunk_sources"] = [doc_id for _, doc_id in hits[:len(retrieved_chunks)]]
+            return retrieved_chunks
+    else:
+        # Resolve the source to a cached document, ingesting it on first use
+        doc, error_response = resolve_request_document(request_id)
+        if error_response:
+            return None, error_response
+        # Build knowledge base (reused across questions on the same source)
+        logger.info(f"🔄 [{request_id}] Building knowledge base...")
+        index, chunks = ensure_document_index(doc)
         
-        # Store document in memory
-        document_store[request_id] = {
-            'source_name': source_name,
-            'source_type': source_type,
-            'chunks': chunks,
-            'index': index,
-            'timestamp': datetime.now().isoformat()
+        if not chunks:
+            logger.warning(f"❌ [{request_id}] No text chunks created")
+            return None, (jsonify({"error": "Could not create text chunks from the source"}), 400)
+        doc_info = {
+            "doc_id": doc['doc_id'],
+            "source_name": doc['source_name'],
+            "source_type": doc['source_type']
         }
+        total_chunks = len(chunks)
+        cache_scope = doc['doc_id']
+        def retrieve():
+            logger.info(f"🔍 [{request_id}] Retrieving relevant information...")
+            retrieved_chunks = retrieve_chunks(question, index, chunks, k=RETRIEVAL_TOP_K, bm25=doc.get('bm25'))
+            return pack_context(question, retrieved_chunks)
+    return {
+        "question": question,
+        "doc_info": doc_info,
+        "total_chunks": total_chunks,
+        "cache_scope": cache_scope,
+        # Follow-up questions from the same client session reuse the model's context for this source
+        "session_key": f"{session_id}:{cache_scope}" if session_id else None,
+        "retrieve": retrieve
+    }, None
+def cached_answer_data(request_id, state, cached):
+    """Response fields for an answer served from the semantic answer cache"""
+    cached_answer, similarity = cached
+    logger.info(f"♻ [{request_id}] Semantic answer cache hit (similarity {similarity:.3f})")
+    return {
+        "message": "Answer served from cache",
+        "request_id": request_id,
+        **state["doc_info"],
+        "question": state["question"],
+        "answer": cached_answer["answer"],
+        "chunks_used": cached_answer["chunks_used"],
+        "total_chunks": state["total_chunks"],
+        "cached": True,
+        "cached_question": cached_answer["question"],
+        "cache_similarity": round(similarity, 4)
+    }
+def sse_event(data, event=None):
+    """Format one Server-Sent Event carrying a JSON payload"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+def sse_response(events):
+    """Stream an iterable of formatted events without proxy buffering"""
+    return Response(events, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+@app.route('/api/answer-question', methods=['POST'])
+def answer_question():
+    """Main endpoint for answering questions about uploaded documents or YouTube videos"""
+    request_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    logger.info(f"🚀 New request [{request_id}] received")
+   
+    try:
+        state, error_response = prepare_question(request_id)
+        if error_response:
+            return error_response
+        question = state["question"]
+        # Serve paraphrases of earlier questions on the same source without calling the LLM
+        follow_up = continues_session(state)
+        cached = None if follow_up else answer_cache.lookup(state["cache_scope"], embed_query(question))
+        if cached is not None:
+            start_cached_session(state)
+            return jsonify(cached_answer_data(request_id, state, cached))
+        # Fail fast if Ollama is down
+        require_ollama()
         # Retrieve relevant chunks and generate answer
-        logger.info(f"🔍 [{request_id}] Retrieving relevant information...")
-        retrieved_chunks = retrieve_chunks(question, index, chunks)
+        retrieved_chunks = state["retrieve"]()
         
         logger.info(f"🤖 [{request_id}] Generating answer...")
-        prompt = construct_prompt(question, retrieved_chunks)
-        answer = get_llm_response(prompt)
+        prompt, params, on_done = session_prompt(request_id, state["session_key"], question, retrieved_chunks)
+        answer = get_llm_response(prompt, on_done=on_done, **params)
+        # Follow-ups only make sense within their session's conversation
+        if not follow_up:
+            answer_cache.add(state["cache_scope"], embed_query(question), {
+                "question": question,
+                "answer": answer,
+                "chunks_used": len(retrieved_chunks)
+            })
         # Prepare response
         response_data = {
             "message": "Answer generated successfully",
             "request_id": request_id,
-            "source_name": source_name,
-            "source_type": source_type,
+            **state["doc_info"],
             "question": question,
             "answer": answer,
             "chunks_used": len(retrieved_chunks),
-            "total_chunks": len(chunks)
+            "total_chunks": state["total_chunks"],
+            "cached": False
         }
         logger.info(f"✅ [{request_id}] Request completed successfully")
         return jsonify(response_data)
+    except OllamaUnavailable as e:
+        return ollama_unavailable_response(request_id, e)
+    except LLMQueueFull as e:
+        return queue_full_response(request_id, e)
     except Exception as e:
         error_details = traceback.format_exc()
         logger.error(f"❌ [{request_id}] Unexpected error: {str(e)}\n{error_details}")
@@ -398,70 +1243,197 @@ def answer_question():
             "request_id": request_id,
             "details": "Check server logs for more information"
         }), 500
-@app.route('/api/generate-quiz', methods=['POST'])
-def generate_quiz():
-    """Endpoint for generating a quiz based on the source"""
+@app.route('/api/answer-question/stream', methods=['POST'])
+def answer_question_stream():
+    """Streaming variant of answer_question that forwards answer tokens as Server-Sent Events.
+    Sends a 'meta' event with the response fields, one {"token": ...} event per generated piece,
+    then 'done' (or 'error' if generation fails midway). Errors before streaming starts are plain JSON."""
     request_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    logger.info(f"🚀 New quiz generation request [{request_id}] received")
+    logger.info(f"🚀 New streaming request [{request_id}] received")
    
     try:
-        num_questions = int(request.form.get('num_questions', 5))
-        difficulty = request.form.get('difficulty', 'medium').lower()
-        youtube_url = request.form.get('youtube_url', '').strip()
-        
-        if num_questions < 1 or num_questions > 20:
-            return jsonify({"error": "Number of questions must be between 1 and 20"}), 400
-        
-        if difficulty not in ['easy', 'medium', 'hard']:
-            return jsonify({"error": "Invalid difficulty level"}), 400
-        # Initialize Ollama
-        initialize_ollama()
-        # Process input based on type (file or YouTube URL)
-        source_type = "youtube" if youtube_url else "file"
-        text = ""
-        source_name = youtube_url if youtube_url else ""
-        if source_type == "file":
-            if 'file' not in request.files:
-                logger.warning(f"❌ [{request_id}] No file uploaded")
-                return jsonify({"error": "No file uploaded"}), 400
-            file = request.files['file']
-            if file.filename == '':
-                logger.warning(f"❌ [{request_id}] No file selected")
-                return jsonify({"error": "No file selected"}), 400
-            allowed_extensions = ('.pdf', '.mp3', '.wav')
-            if not file.filename.lower().endswith(allowed_extensions):
-                logger.warning(f"❌ [{request_id}] Invalid file type: {file.filename}")
-                return jsonify({"error": "Please upload a valid PDF or audio file (MP3, WAV)"}), 400
-            source_name = file.filename
-            logger.info(f"📁 [{request_id}] Processing file: {file.filename}")
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{request_id}_{file.filename}")
-            file.save(file_path)
+        state, error_response = prepare_question(request_id)
+        if error_response:
+            return error_response
+        question = state["question"]
+        follow_up = continues_session(state)
+        cached = None if follow_up else answer_cache.lookup(state["cache_scope"], embed_query(question))
+        if cached is not None:
+            start_cached_session(state)
+            response_data = cached_answer_data(request_id, state, cached)
+            answer = response_data.pop("answer")
+            def cached_events():
+                yield sse_event(response_data, "meta")
+                yield sse_event({"token": answer})
+                yield sse_event({"message": response_data["message"]}, "done")
+            return sse_response(cached_events())
+        require_ollama()
+        retrieved_chunks = state["retrieve"]()
+        prompt, params, on_done = session_prompt(request_id, state["session_key"], question, retrieved_chunks)
+        meta = {
+            "request_id": request_id,
+            **state["doc_info"],
+            "question": question,
+            "chunks_used": len(retrieved_chunks),
+            "total_chunks": state["total_chunks"],
+            "cached": False
+        }
+        # Take the generation slot up front so a full queue is still a 429 rather than a stream error
+        slot = llm_scheduler.acquire(LLM_PRIORITY_QA)
+        def events():
+            yield sse_event(meta, "meta")
+            pieces = []
             try:
-                if file.filename.lower().endswith('.pdf'):
-                    logger.info(f"📄 [{request_id}] Processing PDF file...")
-                    text = extract_text_from_pdf(file_path)
-                else:
-                    logger.info(f"🎵 [{request_id}] Processing audio file...")
-                    text = transcribe_audio(file_path)
-            finally:
-                if os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                        logger.info(f"🗑 [{request_id}] Temporary file cleaned up")
-                    except Exception as e:
-                        logger.warning(f"⚠ [{request_id}] Failed to remove temporary file: {e}")
-        else:
-            logger.info(f"🎥 [{request_id}] Processing YouTube URL: {youtube_url}")
-            text = extract_text_from_youtube(youtube_url)
-        if not text or len(text.strip()) < 10:
-            logger.warning(f"❌ [{request_id}] No meaningful text extracted")
-            return jsonify({"error": "No meaningful text could be extracted from the source"}), 400
-        # Clean text and limit context size for prompt
-        cleaned_text = clean_text(text)
-        context = cleaned_text[:20000]  # Limit to ~20000 chars to fit context
-        # Construct prompt for quiz generation with strict JSON enforcement
-        logger.info(f"🤖 [{request_id}] Generating quiz with {num_questions} {difficulty} questions...")
-        prompt = f"""You are StudyMate, an intelligent quiz generator. Your task is to generate exactly {num_questions} {difficulty} multiple-choice questions based on the provided context from a document or video transcript.
+                with slot:
+                    for token in stream_llm_response(prompt, on_done=on_done, **params):
+                        pieces.append(token)
+                        yield sse_event({"token": token})
+            except Exception as e:
+                logger.error(f"❌ [{request_id}] Streaming failed: {str(e)}")
+                yield sse_event({"error": str(e), "request_id": request_id}, "error")
+                return
+            answer = "".join(pieces).strip()
+            if not answer:
+                answer = EMPTY_RESPONSE_MESSAGE
+                yield sse_event({"token": answer})
+            if not follow_up:
+                answer_cache.add(state["cache_scope"], embed_query(question), {
+                    "question": question,
+                    "answer": answer,
+                    "chunks_used": len(retrieved_chunks)
+                })
+            logger.info(f"✅ [{request_id}] Streamed answer of {len(answer)} characters")
+            yield sse_event({"message": "Answer generated successfully"}, "done")
+        response = sse_response(events())
+        # Also frees the slot if the client disconnects before the stream starts
+        response.call_on_close(slot.release)
+        return response
+    except OllamaUnavailable as e:
+        return ollama_unavailable_response(request_id, e)
+    except LLMQueueFull as e:
+        return queue_full_response(request_id, e)
+    except Exception as e:
+        error_details = traceback.format_exc()
+        logger.error(f"❌ [{request_id}] Unexpected error: {str(e)}\n{error_details}")
+        return jsonify({
+            "error": str(e),
+            "request_id": request_id,
+            "details": "Check server logs for more information"
+        }), 500
+@app.route('/api/answer-questions', methods=['POST'])
+def answer_questions():
+    """Endpoint for answering a batch of questions about one document in a single request"""
+    request_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    logger.info(f"🚀 New batch question request [{request_id}] received")
+   
+    try:
+        # Questions as repeated 'questions' fields or one JSON array
+        values = request.form.getlist('questions')
+        if len(values) == 1 and values[0].lstrip().startswith('['):
+            try:
+                values = json.loads(values[0])
+            except json.JSONDecodeError:
+                return jsonify({"error": "questions must be a JSON array of strings"}), 400
+        questions = [str(q).strip() for q in values if str(q).strip()]
+        if not questions:
+            logger.warning(f"❌ [{request_id}] No questions provided")
+            return jsonify({"error": "No questions provided"}), 400
+        if len(questions) > MAX_BATCH_QUESTIONS:
+            return jsonify({"error": f"Too many questions: {len(questions)} (maximum {MAX_BATCH_QUESTIONS})"}), 400
+        logger.info(f"❓ [{request_id}] {len(questions)} questions")
+        doc, error_response = resolve_request_document(request_id)
+        if error_response:
+            return error_response
+        index, chunks = ensure_document_index(doc)
+        if not chunks:
+            logger.warning(f"❌ [{request_id}] No text chunks created")
+            return jsonify({"error": "Could not create text chunks from the source"}), 400
+        # One encode call for every question, shared by the answer cache and retrieval
+        query_embeddings = embed_queries(questions)
+        results = [None] * len(questions)
+        pending = []
+        for i, question in enumerate(questions):
+            cached = answer_cache.lookup(doc['doc_id'], query_embeddings[i:i + 1])
+            if cached is None:
+                pending.append(i)
+                continue
+            cached_answer, similarity = cached
+            results[i] = {
+                "question": question,
+                "answer": cached_answer["answer"],
+                "chunks_used": cached_answer["chunks_used"],
+                "cached": True,
+                "cached_question": cached_answer["question"],
+                "cache_similarity": round(similarity, 4)
+            }
+        logger.info(f"♻ [{request_id}] {len(questions) - len(pending)} answers served from cache")
+        if pending:
+            require_ollama()
+            # One batched index search for every uncached question
+            retrieved = retrieve_chunks_batch([questions[i] for i in pending], index, chunks, k=RETRIEVAL_TOP_K,
+                                              bm25=doc.get('bm25'), query_embeddings=query_embeddings[pending])
+            def answer(i, retrieved_chunks):
+                question = questions[i]
+                retrieved_chunks = pack_context(question, retrieved_chunks)
+                try:
+                    answer = get_llm_response(construct_prompt(question, retrieved_chunks), priority=LLM_PRIORITY_QUIZ)
+                except Exception as e:
+                    logger.error(f"❌ [{request_id}] Question {i + 1} failed: {e}")
+                    return {"question": question, "error": str(e), "chunks_used": len(retrieved_chunks), "cached": False}
+                answer_cache.add(doc['doc_id'], query_embeddings[i:i + 1], {
+                    "question": question,
+                    "answer": answer,
+                    "chunks_used": len(retrieved_chunks)
+                })
+                return {"question": question, "answer": answer, "chunks_used": len(retrieved_chunks), "cached": False}
+            logger.info(f"🤖 [{request_id}] Generating {len(pending)} answers, {OLLAMA_CONCURRENCY} at a time...")
+            with ThreadPoolExecutor(max_workers=OLLAMA_CONCURRENCY) as pool:
+                for i, result in zip(pending, pool.map(answer, pending, retrieved)):
+                    results[i] = result
+        failed = sum(1 for result in results if "error" in result)
+        logger.info(f"✅ [{request_id}] Batch completed: {len(results) - failed} answered, {failed} failed")
+        return jsonify({
+            "message": "Answers generated successfully" if not failed else f"{failed} of {len(results)} answers failed",
+            "request_id": request_id,
+            "doc_id": doc['doc_id'],
+            "source_name": doc['source_name'],
+            "source_type": doc['source_type'],
+            "total_chunks": len(chunks),
+            "answers": results,
+            "answered": len(results) - failed,
+            "failed": failed
+        })
+    except OllamaUnavailable as e:
+        return ollama_unavailable_response(request_id, e)
+    except LLMQueueFull as e:
+        return queue_full_response(request_id, e)
+    except Exception as e:
+        error_details = traceback.format_exc()
+        logger.error(f"❌ [{request_id}] Unexpected error: {str(e)}\n{error_details}")
+        return jsonify({
+            "error": str(e),
+            "request_id": request_id,
+            "details": "Check server logs for more information"
+        }), 500
+def quiz_sections(chunks, section_chunks=QUIZ_SECTION_CHUNKS):
+    """Split a document into contiguous (start, end) sections of about section_chunks chunks each"""
+    starts = chunks.starts.tolist()
+    ends = chunks.ends.tolist()
+    return [(starts[i], ends[min(i + section_chunks, len(starts)) - 1]) for i in range(0, len(starts), section_chunks)]
+def spread(items, count):
+    """Pick count items evenly spaced across the list, keeping their order"""
+    if count >= len(items):
+        return list(items)
+    return [items[i] for i in np.linspace(0, len(items) - 1, count).round().astype(int)]
+def split_count(total, parts):
+    """Split total into parts near-equal positive counts"""
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+def quiz_prompt(context, num_questions, difficulty, avoid=()):
+    """Prompt for num_questions multiple-choice questions about one section of a document"""
+    avoid_block = ""
+    if avoid:
+        avoid_block = "**Already asked (do not repeat these)**:\n" + "\n".join(f"- {q}" for q in avoid) + "\n"
+    return f"""You are StudyMate, an intelligent quiz generator. Your task is to generate exactly {num_questions} {difficulty} multiple-choice questions based on the provided context from a document or video transcript.
 **Difficulty Guidelines**:
 - **Easy**: Focus on basic facts and definitions.
 - **Medium**: Require understanding and application of concepts.
@@ -487,139 +1459,97 @@ def generate_quiz():
     ...
   ]
 }}
-**Context**:
+{avoid_block}**Context**:
 {context}
 """
-        # Retry mechanism for handling malformed JSON
-        max_retries = 2
-        response_text = None
-        for attempt in range(max_retries):
-            try:
-                response_text = get_llm_response(prompt)
-                logger.info(f"[{request_id}] Raw LLM response (attempt {attempt + 1}): {response_text[:200]}...")
-                # Clean response by removing markdown or extra text
-                if response_text.startswith('```json'):
-                    response_text = response_text.strip('```json').strip('```').strip()
-                # Parse JSON
-                quiz_data = json.loads(response_text)
-                questions = quiz_data.get('questions', [])
-                if len(questions) != num_questions:
-                    raise ValueError(f"Generated {len(questions)} questions instead of {num_questions}")
-                
-                corrects = []
-                explanations = []
-                frontend_questions = []
-                
-                for q in questions:
-                    if not all(key in q for key in ['question', 'options', 'correct', 'explanation']):
-                        raise ValueError("Invalid question format: missing required keys")
-                    if len(q['options']) != 4:
-                        raise ValueError("Each question must have exactly 4 options")
-                    correct_label = q['correct'].upper()
-                    if correct_label not in 'ABCD':
-                        raise ValueError("Correct answer must be A, B, C, or D")
-                    correct_idx = 'ABCD'.index(correct_label)
-                    corrects.append(correct_idx)
-                    explanations.append(q['explanation'])
-                    frontend_questions.append({
-                        "question": q['question'],
-                        "options": q['options']
-                    })
-                
-                # Store quiz data
-                quiz_id = request_id
-                quiz_store[quiz_id] = {
-                    "corrects": corrects,
-                    "explanations": explanations,
-                    "source_name": source_name,
-                    "source_type": source_type,
-                    "timestamp": datetime.now().isoformat()
+def validate_quiz_question(q):
+    """Return the question with its correct label normalised, or None if it is malformed"""
+    if not isinstance(q, dict) or not all(key in q for key in ['question', 'options', 'correct', 'explanation']):
+        return None
+    if not isinstance(q['options'], list) or len(q['options']) != 4:
+        return None
+    correct_label = str(q['correct']).strip().upper()[:1]
+    if not correct_label or correct_label not in 'ABCD':
+        return None
+    return {**q, "correct": correct_label}
+def quiz_schema(num_questions):
+    """JSON schema for Ollama's format option, so the model can only emit well-formed questions"""
+    return {
+        "type": "object",
+        "properties": {
+            "questions": {
+                "type": "array",
+                "minItems": num_questions,
+                "maxItems": num_questions,
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "question": {"type": "string"},
+                        "options": {"type": "array", "items": {"type": "string"}, "minItems": 4, "maxItems": 4},
+                        "correct": {"type": "string", "enum": ["A", "B", "C", "D"]},
+                        "explanation": {"type": "string"}
+                    },
+                    "required": ["question", "options", "correct", "explanation"]
                 }
-                
-                logger.info(f"✅ [{request_id}] Quiz generated successfully with {num_questions} questions")
-                return jsonify({
-                    "quiz_id": quiz_id,
-                    "questions": frontend_questions
-                })
-                
-            except json.JSONDecodeError as json_err:
-                logger.warning(f"❌ [{request_id}] JSON parse error on attempt {attempt + 1}: {str(json_err)}")
-                if attempt < max_retries - 1:
-                    logger.info(f"🔄 [{request_id}] Retrying with stricter prompt...")
-                    prompt += "\n\n**CRITICAL**: Ensure the output is valid JSON only, with no extra text, markdown, or incomplete structures."
-                else:
-                    logger.error(f"❌ [{request_id}] Failed to parse JSON after {max_retries} attempts")
-                    return jsonify({
-                        "error": "Failed to parse quiz data from model response",
-                        "request_id": request_id,
-                        "details": f"Raw response: {response_text[:500]}..."
-                    }), 500
-            except ValueError as ve:
-                logger.error(f"❌ [{request_id}] Invalid quiz data: {str(ve)}")
-                return jsonify({
-                    "error": f"Invalid quiz data generated: {str(ve)}",
-                    "request_id": request_id
-                }), 500
-        
-    except Exception as e:
-        error_details = traceback.format_exc()
-        logger.error(f"❌ [{request_id}] Unexpected error: {str(e)}\n{error_details}")
-        return jsonify({
-            "error": str(e),
-            "request_id": request_id,
-            "details": "Check server logs for more information"
-        }), 500
-@app.route('/api/generate-study-plan', methods=['POST'])
-def generate_study_plan():
-    """Endpoint for generating a study plan based on the source"""
-    request_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    logger.info(f"🚀 New study plan generation request [{request_id}] received")
-   
-    try:
-        num_days = int(request.form.get('num_days', 7))
-        
-        if num_days < 1 or num_days > 30:
-            return jsonify({"error": "Number of days must be between 1 and 30"}), 400
-        
-        # Initialize Ollama
-        initialize_ollama()
-        # Process input (only PDF for now)
-        source_type = "file"
-        text = ""
-        source_name = ""
-        if 'file' not in request.files:
-            logger.warning(f"❌ [{request_id}] No file uploaded")
-            return jsonify({"error": "No file uploaded"}), 400
-        file = request.files['file']
-        if file.filename == '':
-            logger.warning(f"❌ [{request_id}] No file selected")
-            return jsonify({"error": "No file selected"}), 400
-        if not file.filename.lower().endswith('.pdf'):
-            logger.warning(f"❌ [{request_id}] Invalid file type: {file.filename}")
-            return jsonify({"error": "Please upload a valid PDF file"}), 400
-        source_name = file.filename
-        logger.info(f"📁 [{request_id}] Processing file: {file.filename}")
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{request_id}_{file.filename}")
-        file.save(file_path)
+            }
+        },
+        "required": ["questions"]
+    }
+def generate_section_questions(request_id, context, num_questions, difficulty, avoid=()):
+    """Generate questions for one section with schema-constrained output. Every valid question salvaged
+    from a reply is kept and only the missing ones are asked for again. Returns what it has if generation
+    fails; OllamaUnavailable and LLMQueueFull propagate so the request can answer 503/429."""
+    valid = []
+    max_attempts = 2
+    for attempt in range(max_attempts):
+        missing = num_questions - len(valid)
+        if missing <= 0:
+            break
+        prompt = quiz_prompt(context, missing, difficulty, tuple(avoid) + tuple(q['question'] for q in valid))
         try:
-            logger.info(f"📄 [{request_id}] Processing PDF file...")
-            text = extract_text_from_pdf(file_path)
-        finally:
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                    logger.info(f"🗑 [{request_id}] Temporary file cleaned up")
-                except Exception as e:
-                    logger.warning(f"⚠ [{request_id}] Failed to remove temporary file: {e}")
-        if not text or len(text.strip()) < 10:
-            logger.warning(f"❌ [{request_id}] No meaningful text extracted")
-            return jsonify({"error": "No meaningful text could be extracted from the source"}), 400
-        # Clean text and limit context size for prompt
-        cleaned_text = clean_text(text)
-        context = cleaned_text[:20000]  # Limit to ~20000 chars to fit context
-        # Construct prompt for study plan generation with strict JSON enforcement
-        logger.info(f"🤖 [{request_id}] Generating study plan for {num_days} days...")
-        prompt = f"""You are StudyMate, an intelligent study planner. Your task is to generate a rough study plan to complete the topics in the provided context within exactly {num_days} days.
+            response_text = get_llm_response(prompt, priority=LLM_PRIORITY_QUIZ, format=quiz_schema(missing))
+        except ValueError as ve:
+            logger.error(f"❌ [{request_id}] Section generation failed: {str(ve)}")
+            break
+        questions = salvage_json_items(response_text, 'questions')
+        found = [q for q in map(validate_quiz_question, questions) if q][:missing]
+        if len(found) < missing:
+            logger.warning(f"⚠ [{request_id}] Salvaged {len(found)} of {missing} questions on attempt {attempt + 1}")
+        valid.extend(found)
+    return valid
+def study_plan_schema(days):
+    """JSON schema for Ollama's format option, limited to the given day numbers"""
+    return {
+        "type": "object",
+        "properties": {
+            "days": {
+                "type": "array",
+                "minItems": len(days),
+                "maxItems": len(days),
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "day": {"type": "integer", "enum": list(days)},
+                        "topics": {"type": "array", "items": {"type": "string"}, "minItems": 2, "maxItems": 4},
+                        "tasks": {"type": "array", "items": {"type": "string"}, "minItems": 3, "maxItems": 5},
+                        "estimated_time": {"type": "string"}
+                    },
+                    "required": ["day", "topics", "tasks", "estimated_time"]
+                }
+            }
+        },
+        "required": ["days"]
+    }
+def study_plan_prompt(context, num_days, days, planned=()):
+    """Prompt for the given day numbers of a num_days study plan; days already planned are listed so the rest fit around them"""
+    if len(days) == num_days:
+        day_requirement = f"- Generate exactly {num_days} days."
+    else:
+        day_requirement = f"- Generate only days {', '.join(map(str, days))}; the other days are already planned."
+    planned_block = ""
+    if planned:
+        planned_block = "**Already planned**:\n" + "\n".join(f"- Day {d['day']}: {', '.join(map(str, d['topics']))}" for d in planned) + "\n\n"
+    return f"""You are StudyMate, an intelligent study planner. Your task is to generate a rough study plan to complete the topics in the provided context within exactly {num_days} days.
 
 First, identify the main topics/sections from the context.
 
@@ -631,7 +1561,7 @@ For each day:
 - Estimate time (e.g., "2-3 hours").
 
 **Requirements**:
-- Generate exactly {num_days} days.
+{day_requirement}
 - Each day must be based on the provided context.
 - Output **only** valid JSON with no additional text, comments, or markdown.
 - Ensure the JSON is properly formatted with correct syntax.
@@ -640,7 +1570,7 @@ For each day:
 {{
   "days": [
     {{
-      "day": 1,
+      "day": {days[0]},
       "topics": ["Topic 1", "Topic 2"],
       "tasks": ["Read chapter 1", "Take notes on key concepts", "Review examples"],
       "estimated_time": "2-3 hours"
@@ -649,58 +1579,195 @@ For each day:
   ]
 }}
 
-**Context**:
+{planned_block}**Context**:
 {context}
 """
-        # Retry mechanism for handling malformed JSON
-        max_retries = 2
-        response_text = None
-        for attempt in range(max_retries):
-            try:
-                response_text = get_llm_response(prompt)
-                logger.info(f"[{request_id}] Raw LLM response (attempt {attempt + 1}): {response_text[:200]}...")
-                # Clean response by removing markdown or extra text
-                if response_text.startswith('```json') or response_text.startswith('```'):
-                    response_text = response_text.strip('```json').strip('```').strip()
-                # Parse JSON
-                plan_data = json.loads(response_text)
-                days = plan_data.get('days', [])
-                if len(days) != num_days:
-                    raise ValueError(f"Generated {len(days)} days instead of {num_days}")
-                
-                for d in days:
-                    if not all(key in d for key in ['day', 'topics', 'tasks', 'estimated_time']):
-                        raise ValueError("Invalid day format: missing required keys")
-                    if not isinstance(d['topics'], list) or len(d['topics']) < 2 or len(d['topics']) > 4:
-                        raise ValueError("Each day must have 2-4 topics")
-                    if not isinstance(d['tasks'], list) or len(d['tasks']) < 3 or len(d['tasks']) > 5:
-                        raise ValueError("Each day must have 3-5 tasks")
-                
-                logger.info(f"✅ [{request_id}] Study plan generated successfully with {num_days} days")
-                return jsonify({
-                    "request_id": request_id,
-                    "days": days
-                })
-                
-            except json.JSONDecodeError as json_err:
-                logger.warning(f"❌ [{request_id}] JSON parse error on attempt {attempt + 1}: {str(json_err)}")
-                if attempt < max_retries - 1:
-                    logger.info(f"🔄 [{request_id}] Retrying with stricter prompt...")
-                    prompt += "\n\n**CRITICAL**: Ensure the output is valid JSON only, with no extra text, markdown, or incomplete structures."
-                else:
-                    logger.error(f"❌ [{request_id}] Failed to parse JSON after {max_retries} attempts")
-                    return jsonify({
-                        "error": "Failed to parse study plan data from model response",
-                        "request_id": request_id,
-                        "details": f"Raw response: {response_text[:500]}..."
-                    }), 500
-            except ValueError as ve:
-                logger.error(f"❌ [{request_id}] Invalid study plan data: {str(ve)}")
-                return jsonify({
-                    "error": f"Invalid study plan data generated: {str(ve)}",
-                    "request_id": request_id
-                }), 500
+def validate_study_day(d, days):
+    """Return the day with its number as an int, or None if it is malformed or not one of the requested days"""
+    if not isinstance(d, dict) or not all(key in d for key in ['day', 'topics', 'tasks', 'estimated_time']):
+        return None
+    try:
+        day = int(d['day'])
+    except (TypeError, ValueError):
+        return None
+    if day not in days:
+        return None
+    if not isinstance(d['topics'], list) or len(d['topics']) < 2 or len(d['topics']) > 4:
+        return None
+    if not isinstance(d['tasks'], list) or len(d['tasks']) < 3 or len(d['tasks']) > 5:
+        return None
+    return {**d, "day": day}
+def question_key(text):
+    return " ".join(re.findall(r'\w+', text.lower()))
+def dedupe_questions(questions, threshold=QUIZ_DUPLICATE_SIMILARITY):
+    """Drop questions whose text repeats or is a near-paraphrase (by embedding similarity) of an earlier one"""
+    if not questions:
+        return []
+    vectors = embedding_batcher.encode([q['question'] for q in questions])
+    kept, kept_keys = [], set()
+    for i, q in enumerate(questions):
+        key = question_key(q['question'])
+        if key in kept_keys or (kept and float(np.max(vectors[kept] @ vectors[i])) >= threshold):
+            continue
+        kept.append(i)
+        kept_keys.add(key)
+    return [questions[i] for i in kept]
+def generate_quiz_questions(request_id, doc, num_questions, difficulty):
+    """Map-reduce quiz generation: ask for a few questions per document section in parallel, then merge,
+    de-duplicate and trim to num_questions. Sections are spread over the whole document; any shortfall
+    is refilled from unused sections (or, for short documents, the same ones with an avoid list)."""
+    _, chunks = ensure_document_index(doc)
+    sections = quiz_sections(chunks) if len(chunks) else [(0, len(doc['cleaned_text']))]
+    unused = list(range(len(sections)))
+    found = {}  # section index -> questions, merged in document order
+    questions = []
+    for round_num in range(QUIZ_MAX_ROUNDS):
+        missing = num_questions - len(questions)
+        if missing <= 0:
+            break
+        wanted = -(-missing // QUIZ_QUESTIONS_PER_SECTION)
+        if unused:
+            picked = spread(unused, wanted)
+            unused = [i for i in unused if i not in picked]
+            avoid = ()
+        else:
+            picked = spread(list(range(len(sections))), wanted)
+            avoid = tuple(q['question'] for q in questions)
+        counts = split_count(missing, len(picked))
+        logger.info(f"🤖 [{request_id}] Round {round_num + 1}: {missing} questions from {len(picked)} of {len(sections)} sections")
+        def generate(section, count):
+            start, end = sections[section]
+            return generate_section_questions(request_id, doc['cleaned_text'][start:end], count, difficulty, avoid)
+        with ThreadPoolExecutor(max_workers=OLLAMA_CONCURRENCY) as pool:
+            for section, result in zip(picked, pool.map(generate, picked, counts)):
+                found.setdefault(section, []).extend(result)
+        questions = dedupe_questions([q for section in sorted(found) for q in found[section]])
+    return spread(questions, num_questions)
+@app.route('/api/generate-quiz', methods=['POST'])
+def generate_quiz():
+    """Endpoint for generating a quiz based on the source"""
+    request_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    logger.info(f"🚀 New quiz generation request [{request_id}] received")
+   
+    try:
+        num_questions = int(request.form.get('num_questions', 5))
+        difficulty = request.form.get('difficulty', 'medium').lower()
+        
+        if num_questions < 1 or num_questions > 20:
+            return jsonify({"error": "Number of questions must be between 1 and 20"}), 400
+        
+        if difficulty not in ['easy', 'medium', 'hard']:
+            return jsonify({"error": "Invalid difficulty level"}), 400
+        # Fail fast if Ollama is down
+        require_ollama()
+        # Resolve the source to a cached document, ingesting it on first use
+        doc, error_response = resolve_request_document(request_id)
+        if error_response:
+            return error_response
+        source_name = doc['source_name']
+        source_type = doc['source_type']
+        logger.info(f"🤖 [{request_id}] Generating quiz with {num_questions} {difficulty} questions...")
+        questions = generate_quiz_questions(request_id, doc, num_questions, difficulty)
+        if len(questions) != num_questions:
+            logger.error(f"❌ [{request_id}] Generated {len(questions)} valid questions instead of {num_questions}")
+            return jsonify({
+                "error": f"Invalid quiz data generated: Generated {len(questions)} questions instead of {num_questions}",
+                "request_id": request_id
+            }), 500
+        corrects = ['ABCD'.index(q['correct']) for q in questions]
+        explanations = [q['explanation'] for q in questions]
+        frontend_questions = [{"question": q['question'], "options": q['options']} for q in questions]
+        # Store quiz data
+        quiz_id = request_id
+        quiz_store.put(quiz_id, {
+            "corrects": corrects,
+            "explanations": explanations,
+            "source_name": source_name,
+            "source_type": source_type,
+            "timestamp": datetime.now().isoformat()
+        })
         
+        logger.info(f"✅ [{request_id}] Quiz generated successfully with {num_questions} questions")
+        return jsonify({
+            "quiz_id": quiz_id,
+            "questions": frontend_questions
+        })
+        
+    except OllamaUnavailable as e:
+        return ollama_unavailable_response(request_id, e)
+    except LLMQueueFull as e:
+        return queue_full_response(request_id, e)
+    except Exception as e:
+        error_details = traceback.format_exc()
+        logger.error(f"❌ [{request_id}] Unexpected error: {str(e)}\n{error_details}")
+        return jsonify({
+            "error": str(e),
+            "request_id": request_id,
+            "details": "Check server logs for more information"
+        }), 500
+@app.route('/api/generate-study-plan', methods=['POST'])
+def generate_study_plan():
+    """Endpoint for generating a study plan based on the source"""
+    request_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    logger.info(f"🚀 New study plan generation request [{request_id}] received")
+   
+    try:
+        num_days = int(request.form.get('num_days', 7))
+        
+        if num_days < 1 or num_days > 30:
+            return jsonify({"error": "Number of days must be between 1 and 30"}), 400
+        
+        # Fail fast if Ollama is down
+        require_ollama()
+        # Resolve the source to a cached document (only PDF for now)
+        doc, error_response = resolve_request_document(
+            request_id,
+            allowed_extensions=('.pdf',),
+            invalid_type_error="Please upload a valid PDF file",
+            allow_youtube=False
+        )
+        if error_response:
+            return error_response
+        # Limit context size for prompt
+        cleaned_text = doc['cleaned_text']
+        context = cleaned_text[:20000]  # Limit to ~20000 chars to fit context
+        logger.info(f"🤖 [{request_id}] Generating study plan for {num_days} days...")
+        # Keep every valid day salvaged from a reply and only ask again for the missing ones
+        plan = {}
+        max_attempts = 3
+        for attempt in range(max_attempts):
+            missing = [day for day in range(1, num_days + 1) if day not in plan]
+            if not missing:
+                break
+            prompt = study_plan_prompt(context, num_days, missing, [plan[day] for day in sorted(plan)])
+            response_text = get_llm_response(prompt, priority=LLM_PRIORITY_PLAN, format=study_plan_schema(missing))
+            logger.info(f"[{request_id}] Raw LLM response (attempt {attempt + 1}): {response_text[:200]}...")
+            for d in salvage_json_items(response_text, 'days'):
+                d = validate_study_day(d, missing)
+                if d and d['day'] not in plan:
+                    plan[d['day']] = d
+            if len(plan) < num_days:
+                logger.warning(f"⚠ [{request_id}] {num_days - len(plan)} of {num_days} days missing or malformed after attempt {attempt + 1}")
+        
+        if len(plan) != num_days:
+            logger.error(f"❌ [{request_id}] Generated {len(plan)} valid days instead of {num_days}")
+            return jsonify({
+                "error": f"Invalid study plan data generated: Generated {len(plan)} valid days instead of {num_days}",
+                "request_id": request_id,
+                "details": f"Raw response: {response_text[:500]}..."
+            }), 500
+        
+        days = [plan[day] for day in range(1, num_days + 1)]
+        logger.info(f"✅ [{request_id}] Study plan generated successfully with {num_days} days")
+        return jsonify({
+            "request_id": request_id,
+            "days": days
+        })
+        
+    except OllamaUnavailable as e:
+        return ollama_unavailable_response(request_id, e)
+    except LLMQueueFull as e:
+        return queue_full_response(request_id, e)
     except Exception as e:
         error_details = traceback.format_exc()
         logger.error(f"❌ [{request_id}] Unexpected error: {str(e)}\n{error_details}")
@@ -723,11 +1790,11 @@ def evaluate_quiz():
         if not quiz_id or not isinstance(user_answers, list):
             return jsonify({"error": "Missing quiz_id or user_answers"}), 400
         
-        if quiz_id not in quiz_store:
+        stored = quiz_store.get(quiz_id)
+        if stored is None:
             logger.warning(f"❌ Quiz ID {quiz_id} not found")
             return jsonify({"error": "Invalid or expired quiz ID"}), 404
         
-        stored = quiz_store[quiz_id]
         corrects = stored['corrects']
         explanations = stored['explanations']
         
@@ -761,7 +1828,7 @@ def evaluate_quiz():
         score = (correct_count / len(corrects)) * 100 if corrects else 0
         
         # Cleanup
-        del quiz_store[quiz_id]
+        quiz_store.pop(quiz_id)
         
         logger.info(f"✅ Quiz {quiz_id} evaluated successfully")
         return jsonify({
@@ -779,19 +1846,32 @@ def detailed_health_check():
     health_status = {
         "timestamp": datetime.now().isoformat(),
         "flask_server": "running",
-        "embeddings_model": "loaded" if embeddings else "failed",
+        "embeddings_model": "loaded" if embeddings is not None else "not loaded yet",
+        "embedding_quantization": EMBEDDING_QUANTIZATION,
+        "embedding_batcher": embedding_batcher.stats(),
         "ollama_connection": "unknown",
-        "document_store_count": len(document_store)
+        "document_store_count": len(document_store),
+        "persisted_document_count": len(document_storage.list_doc_ids()),
+        "document_cache": document_store.stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "corpus_index": {"documents": len(corpus_index), "vectors": corpus_index.ntotal},
+        "quiz_cache": quiz_store.stats(),
+        "prompt_sessions": prompt_sessions.stats(),
+        "llm_scheduler": llm_scheduler.stats()
     }
-    try:
-        initialize_ollama()
-        health_status["ollama_connection"] = "connected"
-        health_status["ollama_model"] = OLLAMA_MODEL
-    except Exception as e:
-        health_status["ollama_connection"] = f"failed: {str(e)}"
+    ollama_state = ollama_monitor.start().stats()
+    health_status["ollama_connection"] = "connected" if ollama_state["ready"] else f"failed: {ollama_state['error']}"
+    health_status["ollama_model"] = OLLAMA_MODEL
+    health_status["ollama_monitor"] = ollama_state
     return jsonify(health_status)
 if __name__ == "__main__":
     logger.info("🚀 Starting StudyMate Flask API...")
-    logger.info(f"📁 Upload folder: {UPLOAD_FOLDER}")
+    logger.info(f"📁 Upload folder: {get_upload_folder()}")
+    logger.info(f"💾 Data directory: {DATA_DIR}")
     logger.info(f"🤖 Ollama model: {OLLAMA_MODEL}")
+    # Warm the embedding model in the background; the debug reloader's watcher process skips it
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        ollama_monitor.start()
+        threading.Thread(target=get_embeddings, name="embedding-warmup", daemon=True).start()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""Micro-benchmark the original word-based chunker against the linear token-aware offset chunker.
+
+Usage: python backend/benchmarks/bench_chunking.py [--sizes 1,5,10,50] [--legacy-max-mb 50]
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import chunk_spans, clean_text  # noqa: E402
+WORDS = ("cell membrane protein energy glucose enzyme reaction equation theorem proof vector matrix "
+         "derivative integral function variable history economy market supply demand").split()
+def build_text(size_mb, seed=0):
+    """Generate cleaned, sentence-structured text of roughly size_mb megabytes"""
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    sentences = []
+    length = 0
+    while length < target:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40))).capitalize() + rng.choice(".!?")
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return clean_text(" ".join(sentences))
+def legacy_chunk_text(text, chunk_size=300, overlap=50):
+    """The original chunker: re-splits the running chunk for every sentence"""
+    if not text:
+        return []
+    sentences = re.split(r'[.!?]+', text)
+    sentences = [s.strip() for s in sentences if s.strip()]
+    chunks = []
+    current_chunk = ""
+    for sentence in sentences:
+        if len(current_chunk.split()) + len(sentence.split()) > chunk_size and current_chunk:
+            chunks.append(current_chunk.strip())
+            words = current_chunk.split()
+            if len(words) > overlap:
+                current_chunk = " ".join(words[-overlap:]) + " " + sentence
+            else:
+                current_chunk = sentence
+        else:
+            current_chunk += " " + sentence if current_chunk else sentence
+    if current_chunk.strip():
+        chunks.append(current_chunk.strip())
+    return chunks
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1,5,10,50', help='Comma-separated input sizes in MB')
+    parser.add_argument('--legacy-max-mb', type=float, default=50, help='Skip the legacy chunker above this size')
+    args = parser.parse_args()
+    print(f"{'size':>6} {'legacy':>10} {'chunks':>8} {'offsets':>10} {'chunks':>8} {'speedup':>8}")
+    for size_mb in [float(size) for size in args.sizes.split(',')]:
+        text = build_text(size_mb)
+        legacy_time = None
+        legacy_count = 0
+        if size_mb <= args.legacy_max_mb:
+            start = time.perf_counter()
+            legacy_count = len(legacy_chunk_text(text))
+            legacy_time = time.perf_counter() - start
+        start = time.perf_counter()
+        spans = chunk_spans(text)
+        span_time = time.perf_counter() - start
+        legacy_col = f"{legacy_time:9.2f}s" if legacy_time is not None else f"{'skipped':>10}"
+        speedup = f"{legacy_time / span_time:7.1f}x" if legacy_time is not None else f"{'-':>8}"
+        print(f"{size_mb:5.0f}M {legacy_col} {legacy_count:8d} {span_time:9.2f}s {len(spans):8d} {speedup}")
+if __name__ == "__main__":
+    main()
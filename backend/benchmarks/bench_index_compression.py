@@ -0,0 +1,64 @@
+"""Compare index memory against recall@5 for each vector compression and re-rank mode.
+
+Chunks the given documents (PDF or plain text) with the app's pipeline, embeds them once, then builds
+one index per (compression, re-rank) mode and measures its serialised size and recall@5 against
+exact flat search. Queries are sentences sampled from the chunks themselves.
+
+Usage: python backend/benchmarks/bench_index_compression.py notes.pdf lecture.txt [--queries 200]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import numpy as np
+import faiss
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app  # noqa: E402
+MODES = [(compression, rerank) for compression in ('none', 'fp16', 'sq8', 'pq') for rerank in ('none', 'flat', 'fp16')
+         if compression == 'none' and rerank == 'none' or compression != 'none' and rerank != compression]
+def load_chunks(paths):
+    chunks = []
+    for path in paths:
+        if path.lower().endswith('.pdf'):
+            text = app.extract_text_from_pdf(path)
+        else:
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+        chunks.extend(app.chunk_text(app.clean_text(text)))
+    return chunks
+def sample_queries(chunks, count, seed=0):
+    rng = random.Random(seed)
+    sentences = [s.strip() for chunk in chunks for s in app.SENTENCE_END_PATTERN.split(chunk) if len(s.split()) >= 5]
+    return rng.sample(sentences, min(count, len(sentences)))
+def recall_at_k(found, truth, k):
+    return float(np.mean([len(set(f[:k]) & set(t[:k])) / k for f, t in zip(found, truth)]))
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('paths', nargs='+', help='Documents to index (.pdf or text)')
+    parser.add_argument('--queries', type=int, default=200, help='Number of sampled query sentences')
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+    chunks = load_chunks(args.paths)
+    vectors = app.embedding_batcher.encode(chunks)
+    queries = app.embedding_batcher.encode(sample_queries(chunks, args.queries))
+    k = min(args.k, len(chunks))
+    exact = faiss.IndexFlatIP(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+    print(f"{len(chunks)} chunks, {len(queries)} queries, recall@{k} against exact search")
+    print(f"{'index':<32} {'bytes/vec':>10} {'total MB':>9} {'recall':>7} {'ms/query':>9}")
+    # Benchmark PQ on small documents too. FAISS needs at least 256 training vectors for 8-bit codes and
+    # warns below 39 * 256; the server falls back to SQ8 there, so small-document PQ rows understate its recall
+    app.PQ_MIN_TRAIN_VECTORS = 256
+    for compression, rerank in MODES:
+        index = app.create_faiss_index(vectors, compression, rerank)
+        app.configure_search(index, k)
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        elapsed = time.perf_counter() - start
+        size = len(faiss.serialize_index(index))
+        print(f"{app.index_description(len(vectors), compression, rerank):<32} {size / len(vectors):10.1f} "
+              f"{size / 1024 / 1024:9.2f} {recall_at_k(found, truth, k):7.3f} {1000 * elapsed / len(queries):9.3f}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Benchmark sequential vs. page-sharded parallel PDF text extraction.
+
+Usage: python backend/benchmarks/bench_pdf_extraction.py [--pages 1000] [--workers N]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import fitz  # PyMuPDF
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import extract_text_from_pdf  # noqa: E402
+PARAGRAPH = ("Photosynthesis converts light energy into chemical energy stored in glucose. "
+             "The light-dependent reactions take place in the thylakoid membranes. ") * 12
+def build_pdf(path, pages):
+    """Write a synthetic textbook-like PDF with the given number of pages"""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Chapter {page_num // 20 + 1}\n{PARAGRAPH}", fontsize=9)
+    doc.save(path)
+    doc.close()
+def legacy_extract_text_from_pdf(file_path):
+    """The original one-page-at-a-time extraction with repeated string concatenation"""
+    doc = fitz.open(file_path)
+    text = ""
+    for page_num in range(len(doc)):
+        page = doc[page_num]
+        page_text = page.get_text()
+        text += f"\n--- Page {page_num + 1} ---\n{page_text}"
+    doc.close()
+    return text
+def timed(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, 'bench.pdf')
+        build_pdf(pdf_path, args.pages)
+        legacy_time, legacy_text = timed(lambda: legacy_extract_text_from_pdf(pdf_path), args.repeat)
+        sequential_time, sequential_text = timed(lambda: extract_text_from_pdf(pdf_path, parallel=False), args.repeat)
+        parallel_time, parallel_text = timed(
+            lambda: extract_text_from_pdf(pdf_path, parallel=True, workers=args.workers), args.repeat)
+    assert legacy_text == sequential_text == parallel_text, "Extraction outputs differ"
+    print(f"{args.pages} pages, {len(parallel_text)} characters")
+    print(f"legacy     : {legacy_time:.3f}s")
+    print(f"sequential : {sequential_time:.3f}s")
+    print(f"parallel   : {parallel_time:.3f}s ({args.workers} workers, {legacy_time / parallel_time:.1f}x vs legacy)")
+if __name__ == "__main__":
+    main()
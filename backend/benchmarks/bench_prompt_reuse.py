@@ -0,0 +1,59 @@
+"""Measure Ollama prefill for follow-up questions with and without prompt sessions.
+
+Indexes one document (PDF or plain text) with the app's pipeline, then asks the same series of
+questions twice against a running Ollama server:
+  stateless   every question sends the full prompt (instructions, context and question)
+  session     follow-ups send only new excerpts and the question, with the previous context tokens
+Prefill tokens and seconds come from Ollama's prompt_eval_count and prompt_eval_duration.
+
+Usage: python backend/benchmarks/bench_prompt_reuse.py notes.pdf [--questions 5] [--num-predict 64]
+"""
+import os
+import sys
+import random
+import argparse
+import statistics
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app  # noqa: E402
+from storage import ChunkList  # noqa: E402
+def load_text(path):
+    if path.lower().endswith('.pdf'):
+        return app.clean_text(app.extract_text_from_pdf(path))
+    with open(path, encoding='utf-8') as f:
+        return app.clean_text(f.read())
+def sample_questions(chunks, count, seed=0):
+    rng = random.Random(seed)
+    sentences = [s.strip() for chunk in chunks for s in app.SENTENCE_END_PATTERN.split(chunk) if len(s.split()) >= 6]
+    return [f"Explain this in more detail: {s}" for s in rng.sample(sentences, min(count, len(sentences)))]
+def run(questions, index, chunks, bm25, options, session_key):
+    """(prefill tokens, prefill seconds) per question"""
+    if session_key:
+        app.prompt_sessions.pop(session_key)
+    results = []
+    for question in questions:
+        retrieved = app.pack_context(question, app.retrieve_chunks(question, index, chunks, k=app.RETRIEVAL_TOP_K, bm25=bm25))
+        prompt, params, on_done = app.session_prompt('bench', session_key, question, retrieved)
+        result = app.ollama.generate(prompt, options=options, **params)
+        on_done(result)
+        results.append((result.get('prompt_eval_count', 0), result.get('prompt_eval_duration', 0) / 1e9))
+    return results
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('path', help='Document to index (.pdf or text)')
+    parser.add_argument('--questions', type=int, default=5, help='Questions per run (the first one is not a follow-up)')
+    parser.add_argument('--num-predict', type=int, default=64, help='Tokens generated per answer')
+    args = parser.parse_args()
+    text = load_text(args.path)
+    index, starts, ends, bm25 = app.build_index([text])
+    chunks = ChunkList(text, starts, ends)
+    questions = sample_questions(chunks, args.questions)
+    options = {**app.OLLAMA_GENERATE_OPTIONS, 'num_predict': args.num_predict}
+    print(f"{len(chunks)} chunks, {len(questions)} questions, model {app.OLLAMA_MODEL}")
+    print(f"{'mode':<10} {'first tokens':>12} {'first s':>8} {'follow-up tokens':>16} {'follow-up s':>11}")
+    for mode, session_key in (('stateless', None), ('session', 'bench')):
+        results = run(questions, index, chunks, bm25, options, session_key)
+        follow_ups = results[1:] or results
+        print(f"{mode:<10} {results[0][0]:12d} {results[0][1]:8.2f} "
+              f"{statistics.mean(t for t, _ in follow_ups):16.0f} {statistics.mean(s for _, s in follow_ups):11.2f}")
+if __name__ == "__main__":
+    main()
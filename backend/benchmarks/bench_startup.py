@@ -0,0 +1,72 @@
+"""Measure server startup cost: the old eager imports against the lazy app module, with and without int8 quantization.
+
+Each scenario runs in a fresh interpreter so import caches don't carry over:
+  eager         import every heavy module and load the embedding model, as app.py used to at import time
+  lazy import   import app (what a new worker pays before it can accept requests)
+  first query   import app and embed one query (the lazy cost moved to the first request)
+  int8 ...      the same with STUDYMATE_EMBEDDING_QUANTIZATION=int8, plus encode throughput
+
+Usage: python backend/benchmarks/bench_startup.py [--runs 3] [--encode 256]
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+EAGER = """
+import time
+start = time.perf_counter()
+import fitz, faiss, speech_recognition, pydub, youtube_transcript_api
+from sentence_transformers import SentenceTransformer
+SentenceTransformer('all-MiniLM-L6-v2')
+print(time.perf_counter() - start)
+"""
+LAZY_IMPORT = """
+import time
+start = time.perf_counter()
+import app
+print(time.perf_counter() - start)
+"""
+FIRST_QUERY = """
+import time
+start = time.perf_counter()
+import app
+app.embed_query('What is photosynthesis?')
+print(time.perf_counter() - start)
+"""
+ENCODE = """
+import time
+import app
+app.embed_query('warm up')
+texts = ['Sentence %d about cell membranes, enzymes and the energy released by glucose.' % i for i in range({count})]
+start = time.perf_counter()
+app.embedding_batcher.encode(texts)
+print(time.perf_counter() - start)
+"""
+def run(code, env=None, runs=3):
+    """Median of the seconds printed by code over fresh interpreter runs"""
+    times = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', code], cwd=BACKEND_DIR, env={**os.environ, **(env or {})},
+                                capture_output=True, text=True, check=True)
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(times)
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=3, help='Fresh interpreter runs per scenario')
+    parser.add_argument('--encode', type=int, default=256, help='Texts encoded for the throughput rows')
+    args = parser.parse_args()
+    int8 = {'STUDYMATE_EMBEDDING_QUANTIZATION': 'int8'}
+    rows = [
+        ("eager", run(EAGER, runs=args.runs)),
+        ("lazy import", run(LAZY_IMPORT, runs=args.runs)),
+        ("first query", run(FIRST_QUERY, runs=args.runs)),
+        ("int8 first query", run(FIRST_QUERY, int8, runs=args.runs)),
+        (f"encode {args.encode} fp32", run(ENCODE.format(count=args.encode), runs=args.runs)),
+        (f"encode {args.encode} int8", run(ENCODE.format(count=args.encode), int8, runs=args.runs)),
+    ]
+    for name, seconds in rows:
+        print(f"{name:<22} {seconds:8.3f}s")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import re
+from array import array
+import numpy as np
+TOKEN_PATTERN = re.compile(r'\w+')
+def tokenize(text):
+    """Lower-cased word tokens; keeps acronyms, formula names and section numbers as exact terms"""
+    return TOKEN_PATTERN.findall(text.lower())
+class BM25Index:
+    """In-process inverted index with Okapi BM25 scoring over a document's chunks.
+    Chunks are added in order (chunk i gets id i); postings are kept in compact arrays and
+    converted to NumPy on finalize()."""
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}  # term -> (array of chunk ids, array of term frequencies)
+        self._lengths = array('I')
+        self.finalized = False
+    @classmethod
+    def from_chunks(cls, chunks):
+        index = cls()
+        for chunk in chunks:
+            index.add(chunk)
+        index.finalize()
+        return index
+    def __len__(self):
+        return len(self._lengths)
+    def add(self, text):
+        """Index the next chunk"""
+        chunk_id = len(self._lengths)
+        counts = {}
+        tokens = tokenize(text)
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for term, count in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array('I'), array('I'))
+            postings[0].append(chunk_id)
+            postings[1].append(count)
+        self._lengths.append(len(tokens))
+    def indexing(self, chunk_stream):
+        """Pass (start, end, text) chunks through unchanged while indexing their text"""
+        for chunk in chunk_stream:
+            self.add(chunk[2])
+            yield chunk
+    def finalize(self):
+        self._postings = {
+            term: (np.frombuffer(ids, dtype=np.uint32), np.frombuffer(freqs, dtype=np.uint32).astype(np.float32))
+            for term, (ids, freqs) in self._postings.items()
+        }
+        self._lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+        self._average_length = float(self._lengths.mean()) if len(self._lengths) else 0.0
+        self.finalized = True
+        return self
+    @property
+    def nbytes(self):
+        if not self.finalized:
+            return 0
+        return int(self._lengths.nbytes + sum(ids.nbytes + freqs.nbytes + len(term) for term, (ids, freqs) in self._postings.items()))
+    def search(self, query, k):
+        """Return up to k (chunk_id, score) pairs with positive BM25 score, best first"""
+        count = len(self._lengths)
+        if not self.finalized or count == 0:
+            return []
+        scores = np.zeros(count, dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self._lengths / (self._average_length or 1.0))
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            ids, freqs = postings
+            idf = np.log(1 + (count - len(ids) + 0.5) / (len(ids) + 0.5))
+            scores[ids] += idf * freqs * (self.k1 + 1) / (freqs + norm[ids])
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(int(i), float(scores[i])) for i in candidates]
@@ -0,0 +1,181 @@
+import time
+import json
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+logger = logging.getLogger(__name__)
+def estimate_json_size(value):
+    """Rough byte size of a JSON-serializable value"""
+    return len(json.dumps(value, default=str))
+class BoundedCache:
+    """Thread-safe LRU cache with a byte budget and per-entry TTL.
+    Entries are sized with sizeof(value) and the least recently used ones are evicted
+    once the total exceeds max_bytes. Expired entries are dropped on access.
+    on_evict(key, value) is called under the cache lock for entries dropped by eviction, expiry or
+    replacement with a different value; putting the same value again only re-measures it."""
+    def __init__(self, name, max_bytes, ttl_seconds=None, sizeof=estimate_json_size, on_evict=None):
+        self.name = name
+        self.on_evict = on_evict
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sizeof = sizeof
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    def _expired(self, expires_at):
+        return expires_at is not None and time.monotonic() >= expires_at
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+    def _notify(self, key, value):
+        if self.on_evict is not None:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                logger.warning(f"⚠ {self.name} cache eviction hook failed for {key[:16]}: {e}")
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            key, (value, size, _) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            logger.info(f"🧹 Evicted {key[:16]} from {self.name} cache ({size} bytes)")
+            self._notify(key, value)
+    def get(self, key, default=None):
+        """Return the value for key and mark it most recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if self._expired(entry[2]):
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                self._notify(key, entry[0])
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    def _put(self, key, value, size):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        previous = self._entries.get(key)
+        if previous is not None:
+            self._remove(key)
+            if previous[0] is not value:
+                self._notify(key, previous[0])
+        if size > self.max_bytes:
+            logger.warning(f"⚠ Entry {key[:16]} ({size} bytes) exceeds the {self.name} cache budget, not cached")
+            if previous is not None and previous[0] is value:
+                # A re-measured value that no longer fits leaves the cache
+                self._notify(key, value)
+            return value
+        self._entries[key] = (value, size, expires_at)
+        self.total_bytes += size
+        self._evict()
+        return value
+    def put(self, key, value):
+        """Insert or re-size an entry, evicting least recently used entries over budget"""
+        size = self.sizeof(value)
+        with self._lock:
+            return self._put(key, value, size)
+    def setdefault(self, key, value):
+        """Return the live value for key, inserting value if it is missing"""
+        size = self.sizeof(value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry[2]):
+                self._entries.move_to_end(key)
+                return entry[0]
+            if entry is not None:
+                self._remove(key)
+                self.expirations += 1
+                self._notify(key, entry[0])
+            return self._put(key, value, size)
+    def refresh(self, key, value):
+        """Re-measure value after it grew, if it is still the live entry for key; returns whether it was.
+        Unlike put, never re-inserts a value that was evicted in the meantime."""
+        size = self.sizeof(value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not value or self._expired(entry[2]):
+                return False
+            self._put(key, value, size)
+            return key in self._entries
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._remove(key)
+            return entry[0]
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+    def stats(self):
+        """Counters for the health endpoint"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / (self.hits + self.misses), 3) if self.hits + self.misses else 0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+class SemanticAnswerCache:
+    """Per-scope cache of generated answers keyed by question embeddings.
+    A lookup hits when a stored question's cosine similarity with the new one reaches threshold
+    (embeddings must be L2-normalised). Scopes (usually a doc_id) and the entries within each scope
+    are both bounded, dropping the least recently used first."""
+    def __init__(self, threshold=0.92, max_scopes=512, max_entries_per_scope=256):
+        self.threshold = threshold
+        self.max_scopes = max_scopes
+        self.max_entries_per_scope = max_entries_per_scope
+        self._scopes = OrderedDict()  # scope -> {"vectors": ndarray, "values": list}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    def lookup(self, scope, vector):
+        """Return (value, similarity) for the closest stored question at or above threshold, else None"""
+        vector = np.asarray(vector, dtype='float32').reshape(-1)
+        with self._lock:
+            entry = self._scopes.get(scope)
+            if entry is not None and len(entry["values"]):
+                similarities = entry["vectors"] @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._scopes.move_to_end(scope)
+                    self.hits += 1
+                    return entry["values"][best], float(similarities[best])
+            self.misses += 1
+            return None
+    def add(self, scope, vector, value):
+        vector = np.asarray(vector, dtype='float32').reshape(1, -1)
+        with self._lock:
+            entry = self._scopes.get(scope)
+            if entry is None:
+                entry = self._scopes[scope] = {"vectors": np.empty((0, vector.shape[1]), dtype='float32'), "values": []}
+            entry["vectors"] = np.vstack([entry["vectors"], vector])[-self.max_entries_per_scope:]
+            entry["values"] = (entry["values"] + [value])[-self.max_entries_per_scope:]
+            self._scopes.move_to_end(scope)
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+    def stats(self):
+        """Counters for the health endpoint"""
+        with self._lock:
+            return {
+                "scopes": len(self._scopes),
+                "entries": sum(len(entry["values"]) for entry in self._scopes.values()),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / (self.hits + self.misses), 3) if self.hits + self.misses else 0
+            }
@@ -0,0 +1,106 @@
+import logging
+import threading
+import numpy as np
+from lazy import LazyModule
+faiss = LazyModule('faiss')
+logger = logging.getLogger(__name__)
+DOC_SHIFT = 32  # Vector ID = document number << 32 | chunk number
+def enable_reconstruction(index):
+    """Build the direct map an IVF index needs for index_vectors. Call once when the index is created or
+    loaded, before it is shared: building it mutates the index, so it must not happen under concurrent searches."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    return index
+def index_vectors(index, ids=None):
+    """Reconstruct the stored vectors of a FAISS index (all, or only ids) as a float32 matrix.
+    IVF indexes must have been prepared with enable_reconstruction; this only reads the index."""
+    if ids is None:
+        return index.reconstruct_n(0, index.ntotal)
+    return np.vstack([index.reconstruct(int(i)) for i in ids]) if len(ids) else np.empty((0, index.d), dtype='float32')
+class CorpusIndex:
+    """Shared inner-product index over the chunks of many documents.
+    Vector IDs encode (document number, chunk number), so each hit maps back to its document and
+    chunk, and each document's IDs form one contiguous range for filtering and removal. Adding a
+    document appends its vectors; nothing is rebuilt. description is the FAISS factory string for
+    vector storage ('Flat', or 'SQfp16' to halve memory); it must not need training."""
+    def __init__(self, description='Flat'):
+        self.description = description
+        self._index = None
+        self._lock = threading.Lock()
+        self._doc_numbers = {}  # doc_id -> document number
+        self._doc_ids = {}  # document number -> doc_id
+        self._next_number = 0
+        self._code_sizes = {}
+    def __contains__(self, doc_id):
+        with self._lock:
+            return doc_id in self._doc_numbers
+    def __len__(self):
+        with self._lock:
+            return len(self._doc_numbers)
+    @property
+    def ntotal(self):
+        with self._lock:
+            return self._index.ntotal if self._index is not None else 0
+    def code_size(self, dimension):
+        """Bytes stored per vector"""
+        if dimension not in self._code_sizes:
+            self._code_sizes[dimension] = faiss.index_factory(dimension, self.description).sa_code_size()
+        return self._code_sizes[dimension]
+    def _range(self, number):
+        return faiss.IDSelectorRange(number << DOC_SHIFT, (number + 1) << DOC_SHIFT)
+    def add(self, doc_id, vectors):
+        """Append a document's chunk vectors (row i is chunk i); no-op if it is already present"""
+        with self._lock:
+            if doc_id in self._doc_numbers or len(vectors) == 0:
+                return
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.index_factory(vectors.shape[1], self.description, faiss.METRIC_INNER_PRODUCT))
+            number = self._next_number
+            self._next_number += 1
+            ids = (np.int64(number) << DOC_SHIFT) + np.arange(len(vectors), dtype=np.int64)
+            self._index.add_with_ids(np.ascontiguousarray(vectors, dtype='float32'), ids)
+            self._doc_numbers[doc_id] = number
+            self._doc_ids[number] = doc_id
+        logger.info(f"📚 Added {len(vectors)} chunks of {doc_id[:16]} to the corpus index")
+    def remove(self, doc_id):
+        """Drop a document's vectors from the corpus"""
+        with self._lock:
+            number = self._doc_numbers.pop(doc_id, None)
+            if number is None:
+                return
+            del self._doc_ids[number]
+            self._index.remove_ids(self._range(number))
+    def vectors(self, hits):
+        """Stored vectors for (doc_id, chunk_number, ...) hits, one row per hit"""
+        with self._lock:
+            ids = [(self._doc_numbers[hit[0]] << DOC_SHIFT) + hit[1] for hit in hits]
+            return index_vectors(self._index, ids)
+    def search(self, query_vectors, k, doc_ids=None):
+        """Search all documents, or only doc_ids, in one call.
+        Returns one list of (doc_id, chunk_number, score) per query row, best first."""
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                return [[] for _ in range(len(query_vectors))]
+            params = None
+            if doc_ids is not None:
+                numbers = [self._doc_numbers[doc_id] for doc_id in doc_ids if doc_id in self._doc_numbers]
+                if not numbers:
+                    return [[] for _ in range(len(query_vectors))]
+                selectors = [self._range(number) for number in numbers]
+                selector = selectors[0]
+                for other in selectors[1:]:
+                    selector = faiss.IDSelectorOr(selector, other)
+                params = faiss.SearchParameters(sel=selector)
+            scores, ids = self._index.search(query_vectors, min(k, self._index.ntotal), params=params)
+            results = []
+            for row_scores, row_ids in zip(scores, ids):
+                hits = []
+                for score, vector_id in zip(row_scores, row_ids):
+                    if vector_id < 0:
+                        continue
+                    doc_id = self._doc_ids.get(int(vector_id) >> DOC_SHIFT)
+                    if doc_id is not None:
+                        hits.append((doc_id, int(vector_id) & ((1 << DOC_SHIFT) - 1), float(score)))
+                results.append(hits)
+            return results
@@ -0,0 +1,91 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+import numpy as np
+logger = logging.getLogger(__name__)
+class EmbeddingBatcher:
+    """Coalesce encode() calls from many threads into shared model batches on a single worker thread.
+    Requests arriving within window_seconds of the first pending one are encoded together (up to
+    max_batch_size texts) and each caller gets back its own rows. Running every forward pass on one
+    thread also keeps concurrent requests from fighting over torch's intra-op thread pool.
+    Vectors are L2-normalised by default so inner product equals cosine similarity. load_model returns
+    the model and is called on every use, so it can load the model lazily. The worker thread starts on
+    the first encode(), so importing a module that creates a batcher starts no threads."""
+    def __init__(self, load_model, window_seconds=0.005, max_batch_size=128, encode_batch_size=32, normalize=True):
+        self.load_model = load_model
+        self.normalize = normalize
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.encode_batch_size = encode_batch_size
+        self._requests = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+        self._worker = None
+        self._worker_lock = threading.Lock()
+    def _start(self):
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+    def encode(self, texts):
+        """Encode texts into a float32 array of shape (len(texts), dimension), blocking until done"""
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.load_model().get_sentence_embedding_dimension()), dtype='float32')
+        self._start()
+        future = Future()
+        self._requests.put((texts, future))
+        return future.result()
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            count = len(batch[0][0])
+            deadline = time.monotonic() + self.window_seconds
+            while count < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                count += len(item[0])
+            self._encode_batch(batch)
+    def _encode_batch(self, batch):
+        all_texts = [text for texts, _ in batch for text in texts]
+        try:
+            vectors = self.load_model().encode(
+                all_texts,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+                batch_size=self.encode_batch_size,
+                normalize_embeddings=self.normalize
+            ).astype('float32')
+        except Exception as e:
+            logger.error(f"❌ Embedding batch of {len(all_texts)} texts failed: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        with self._stats_lock:
+            self.requests += len(batch)
+            self.batches += 1
+            self.texts += len(all_texts)
+        offset = 0
+        for texts, future in batch:
+            future.set_result(vectors[offset:offset + len(texts)])
+            offset += len(texts)
+    def stats(self):
+        """Counters for the health endpoint"""
+        with self._stats_lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "texts": self.texts,
+                "avg_requests_per_batch": round(self.requests / self.batches, 2) if self.batches else 0,
+                "pending": self._requests.qsize()
+            }
@@ -10,6 +10,8 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 import io
 import json
+import hashlib
+import uuid
 # Page configuration
 st.set_page_config(
     page_title="StudyMate - AI Learning Platform",
@@ -240,6 +242,8 @@ st.markdown("""
 """, unsafe_allow_html=True)
 # Configuration
 FLASK_API_URL = "http://localhost:5000/api/answer-question"
+FLASK_STREAM_API_URL = "http://localhost:5000/api/answer-question/stream"
+FLASK_DOCUMENTS_API_URL = "http://localhost:5000/api/documents"
 FLASK_QUIZ_API_URL = "http://localhost:5000/api/generate-quiz"
 FLASK_EVAL_API_URL = "http://localhost:5000/api/evaluate-quiz"
 FLASK_PLAN_API_URL = "http://localhost:5000/api/generate-study-plan"
@@ -266,18 +270,66 @@ if 'study_plan' not in st.session_state:
     st.session_state.study_plan = None
 if 'plans_generated' not in st.session_state:
     st.session_state.plans_generated = 0
-# Function to call Flask API for Q&A
-def call_flask_api(source=None, youtube_url=None, question=None):
-    """Call the Flask API to get answer for the question"""
+if 'document_ids' not in st.session_state:
+    st.session_state.document_ids = {}
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+# Function to pick the session_id sent with a question
+def question_session_id(follow_up):
+    """Keep the session for a follow-up, so the backend reuses the model's context; start a new one for a
+    fresh question, so it can be answered from (and added to) the backend's answer cache"""
+    if not follow_up:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
+# Function to upload a source once and reuse its doc_id
+def get_document_id(source=None, youtube_url=None):
+    """Upload the source to the Flask API once per session and return its doc_id"""
+    key = youtube_url or hashlib.sha256(source.getvalue()).hexdigest()
+    if key in st.session_state.document_ids:
+        return {"doc_id": st.session_state.document_ids[key], "key": key}
     try:
-        data = {'question': question}
+        data = {}
         files = None
         if youtube_url:
             data['youtube_url'] = youtube_url
         elif source:
             files = {'file': (source.name, source.getvalue(), source.type)}
         
-        response = requests.post(FLASK_API_URL, files=files, data=data, timeout=120)
+        response = requests.post(FLASK_DOCUMENTS_API_URL, files=files, data=data, timeout=120)
+        
+        if response.status_code == 200:
+            doc_id = response.json()['doc_id']
+            st.session_state.document_ids[key] = doc_id
+            return {"doc_id": doc_id, "key": key}
+        else:
+            error_data = response.json() if response.headers.get('content-type') == 'application/json' else {"error": response.text}
+            return {"error": error_data.get('error', 'Unknown error'), "request_id": error_data.get('request_id', 'N/A')}
+    except requests.exceptions.ConnectionError:
+        return {"error": "Cannot connect to Flask server. Please ensure it's running on http://localhost:5000", "request_id": "N/A"}
+    except requests.exceptions.Timeout:
+        return {"error": "Request timed out. The file or video might be too large or processing is taking too long.", "request_id": "N/A"}
+    except Exception as e:
+        return {"error": f"Unexpected error: {str(e)}", "request_id": "N/A"}
+# Function to post a request that refers to an uploaded source by doc_id
+def post_with_document(url, data, source=None, youtube_url=None, timeout=120, stream=False):
+    """POST to the Flask API with the source's doc_id, re-uploading once if the server forgot it"""
+    for attempt in range(2):
+        document = get_document_id(source=source, youtube_url=youtube_url)
+        if 'error' in document:
+            return document
+        response = requests.post(url, data={**data, 'doc_id': document['doc_id']}, timeout=timeout, stream=stream)
+        if response.status_code != 404 or attempt == 1:
+            return response
+        # The backend restarted or evicted the document, so upload it again
+        st.session_state.document_ids.pop(document['key'], None)
+# Function to call Flask API for Q&A
+def call_flask_api(source=None, youtube_url=None, question=None, follow_up=False):
+    """Call the Flask API to get answer for the question"""
+    try:
+        data = {'question': question, 'session_id': question_session_id(follow_up)}
+        response = post_with_document(FLASK_API_URL, data, source=source, youtube_url=youtube_url)
+        if isinstance(response, dict):
+            return response
         
         if response.status_code == 200:
             return response.json()
@@ -290,6 +342,53 @@ def call_flask_api(source=None, youtube_url=None, question=None):
         return {"error": "Request timed out. The file or video might be too large or processing is taking too long.", "request_id": "N/A"}
     except Exception as e:
         return {"error": f"Unexpected error: {str(e)}", "request_id": "N/A"}
+# Function to parse Server-Sent Events from a streaming response
+def iter_sse_events(response):
+    """Yield (event, data) pairs from a Server-Sent Events response with JSON payloads"""
+    event, data = 'message', []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = 'message', []
+        elif line.startswith('event:'):
+            event = line[len('event:'):].strip()
+        elif line.startswith('data:'):
+            data.append(line[len('data:'):].strip())
+# Function to call the streaming Flask API for Q&A
+def stream_flask_api(source=None, youtube_url=None, question=None, follow_up=False):
+    """Call the streaming Q&A endpoint. Returns (result, tokens): result fills in with the answer
+    details as events arrive (or holds an error), and tokens yields answer text for st.write_stream."""
+    result = {}
+    try:
+        data = {'question': question, 'session_id': question_session_id(follow_up)}
+        response = post_with_document(FLASK_STREAM_API_URL, data, source=source, youtube_url=youtube_url, stream=True)
+        if isinstance(response, dict):
+            return response, iter(())
+        
+        if response.status_code != 200:
+            error_data = response.json() if response.headers.get('content-type') == 'application/json' else {"error": response.text}
+            return {"error": error_data.get('error', 'Unknown error'), "request_id": error_data.get('request_id', 'N/A')}, iter(())
+    except requests.exceptions.ConnectionError:
+        return {"error": "Cannot connect to Flask server. Please ensure it's running on http://localhost:5000", "request_id": "N/A"}, iter(())
+    except requests.exceptions.Timeout:
+        return {"error": "Request timed out. The file or video might be too large or processing is taking too long.", "request_id": "N/A"}, iter(())
+    except Exception as e:
+        return {"error": f"Unexpected error: {str(e)}", "request_id": "N/A"}, iter(())
+    def tokens():
+        try:
+            for event, payload in iter_sse_events(response):
+                if event == 'message':
+                    yield payload.get('token', '')
+                elif event == 'error':
+                    result.update({"error": payload.get('error', 'Unknown error'), "request_id": payload.get('request_id', 'N/A')})
+                else:
+                    result.update(payload)
+        except requests.exceptions.RequestException as e:
+            result.update({"error": f"Connection lost while streaming the answer: {str(e)}", "request_id": result.get('request_id', 'N/A')})
+        finally:
+            response.close()
+    return result, tokens()
 # Function to call Flask API for quiz generation
 def generate_quiz_api(source=None, youtube_url=None, num_questions=5, difficulty='medium'):
     """Call the Flask API to generate quiz"""
@@ -298,14 +397,9 @@ def generate_quiz_api(source=None, youtube_url=None, num_questions=5, difficulty
             'num_questions': num_questions,
             'difficulty': difficulty
         }
-        files = None
-        
-        if youtube_url:
-            data['youtube_url'] = youtube_url
-        elif source:
-            files = {'file': (source.name, source.getvalue(), source.type)}
-        
-        response = requests.post(FLASK_QUIZ_API_URL, files=files, data=data, timeout=120)
+        response = post_with_document(FLASK_QUIZ_API_URL, data, source=source, youtube_url=youtube_url)
+        if isinstance(response, dict):
+            return response
         
         if response.status_code == 200:
             return response.json()
@@ -323,12 +417,9 @@ def generate_study_plan_api(source=None, num_days=7):
     """Call the Flask API to generate study plan"""
     try:
         data = {'num_days': num_days}
-        files = None
-        
-        if source:
-            files = {'file': (source.name, source.getvalue(), source.type)}
-        
-        response = requests.post(FLASK_PLAN_API_URL, files=files, data=data, timeout=120)
+        response = post_with_document(FLASK_PLAN_API_URL, data, source=source)
+        if isinstance(response, dict):
+            return response
         
         if response.status_code == 200:
             return response.json()
@@ -595,6 +686,8 @@ if st.session_state.current_page == 'study':
         
         st.markdown("### 💬 Ask Questions")
         question = st.text_input("Ask a question about your PDF:", placeholder="What is the main topic discussed in the document?", key="pdf_question")
+        follow_up = st.checkbox("↪️ Follow-up to my previous question", key="pdf_follow_up", disabled=not st.session_state.qa_history,
+                                help="Continue from the last answer instead of starting fresh")
         
         col1, col2 = st.columns([3, 1])
         with col1:
@@ -614,7 +707,7 @@ if st.session_state.current_page == 'study':
         if ask_button:
             if question and uploaded_pdf:
                 with st.spinner("🤖 Processing your question... This may take a moment."):
-                    result = call_flask_api(source=uploaded_pdf, question=question)
+                    result, answer_stream = stream_flask_api(source=uploaded_pdf, question=question, follow_up=follow_up)
                     
                     if "error" in result:
                         st.error(f"❌ Error: {result['error']} (Request ID: {result['request_id']})")
@@ -625,20 +718,24 @@ if st.session_state.current_page == 'study':
                         st.markdown('</div>', unsafe_allow_html=True)
                         
                         st.markdown('<div class="answer-box">', unsafe_allow_html=True)
-                        st.markdown(f"**🤖 Answer:** {result.get('answer', 'No answer provided')}")
+                        st.markdown("**🤖 Answer:**")
+                        # Tokens render as they are generated
+                        answer = st.write_stream(answer_stream) or 'No answer provided'
                         st.markdown('</div>', unsafe_allow_html=True)
+                        if "error" in result:
+                            st.error(f"❌ Error: {result['error']} (Request ID: {result['request_id']})")
+                        else:
+                            # Save to history
+                            qa_entry = {
+                                "timestamp": datetime.now().isoformat(),
+                                "source": result.get('source_name', uploaded_pdf.name),
+                                "source_type": result.get('source_type', 'file'),
+                                "question": question,
+                                "answer": answer
+                            }
+                            st.session_state.qa_history.append(qa_entry)
                         
-                        # Save to history
-                        qa_entry = {
-                            "timestamp": datetime.now().isoformat(),
-                            "source": result.get('source_name', uploaded_pdf.name),
-                            "source_type": result.get('source_type', 'file'),
-                            "question": question,
-                            "answer": result.get('answer', 'No answer provided')
-                        }
-                        st.session_state.qa_history.append(qa_entry)
-                        
-                        st.success(f"✅ {result.get('message', 'Answer generated successfully!')}")
+                            st.success(f"✅ {result.get('message', 'Answer generated successfully!')}")
                         
             elif not uploaded_pdf:
                 st.warning("⚠️ Please upload a PDF file first.")
@@ -666,6 +763,8 @@ if st.session_state.current_page == 'study':
                 st.session_state.processed_sources.append(uploaded_audio.name)
         
         question_audio = st.text_input("Ask about your audio content:", placeholder="What are the key points discussed in the audio?", key="audio_question")
+        follow_up_audio = st.checkbox("↪️ Follow-up to my previous question", key="audio_follow_up", disabled=not st.session_state.qa_history,
+                                      help="Continue from the last answer instead of starting fresh")
         
         col1, col2 = st.columns([3, 1])
         with col1:
@@ -685,7 +784,7 @@ if st.session_state.current_page == 'study':
         if ask_audio_button:
             if question_audio and uploaded_audio:
                 with st.spinner("🎵 Transcribing and processing audio... This may take a while."):
-                    result = call_flask_api(source=uploaded_audio, question=question_audio)
+                    result, answer_stream = stream_flask_api(source=uploaded_audio, question=question_audio, follow_up=follow_up_audio)
                     
                     if "error" in result:
                         st.error(f"❌ Error: {result['error']} (Request ID: {result['request_id']})")
@@ -695,19 +794,23 @@ if st.session_state.current_page == 'study':
                         st.markdown('</div>', unsafe_allow_html=True)
                         
                         st.markdown('<div class="answer-box">', unsafe_allow_html=True)
-                        st.markdown(f"**🤖 Answer:** {result.get('answer', 'No answer provided')}")
+                        st.markdown("**🤖 Answer:**")
+                        # Tokens render as they are generated
+                        answer = st.write_stream(answer_stream) or 'No answer provided'
                         st.markdown('</div>', unsafe_allow_html=True)
+                        if "error" in result:
+                            st.error(f"❌ Error: {result['error']} (Request ID: {result['request_id']})")
+                        else:
+                            qa_entry = {
+                                "timestamp": datetime.now().isoformat(),
+                                "source": result.get('source_name', uploaded_audio.name),
+                                "source_type": result.get('source_type', 'file'),
+                                "question": question_audio,
+                                "answer": answer
+                            }
+                            st.session_state.qa_history.append(qa_entry)
                         
-                        qa_entry = {
-                            "timestamp": datetime.now().isoformat(),
-                            "source": result.get('source_name', uploaded_audio.name),
-                            "source_type": result.get('source_type', 'file'),
-                            "question": question_audio,
-                            "answer": result.get('answer', 'No answer provided')
-                        }
-                        st.session_state.qa_history.append(qa_entry)
-                        
-                        st.success(f"✅ {result.get('message', 'Answer generated successfully!')}")
+                            st.success(f"✅ {result.get('message', 'Answer generated successfully!')}")
             elif not uploaded_audio:
                 st.warning("⚠️ Please upload an audio file first.")
             elif not question_audio:
@@ -736,6 +839,8 @@ if st.session_state.current_page == 'study':
             placeholder="What are the key points discussed in the video?",
             key="video_question"
         )
+        follow_up_video = st.checkbox("↪️ Follow-up to my previous question", key="video_follow_up", disabled=not st.session_state.qa_history,
+                                      help="Continue from the last answer instead of starting fresh")
         
         col1, col2 = st.columns([3, 1])
         with col1:
@@ -755,7 +860,7 @@ if st.session_state.current_page == 'study':
         if ask_video_button:
             if question_video and youtube_url:
                 with st.spinner("🎥 Processing video transcript... This may take a moment."):
-                    result = call_flask_api(youtube_url=youtube_url, question=question_video)
+                    result, answer_stream = stream_flask_api(youtube_url=youtube_url, question=question_video, follow_up=follow_up_video)
                     
                     if "error" in result:
                         st.error(f"❌ Error: {result['error']} (Request ID: {result['request_id']})")
@@ -765,19 +870,23 @@ if st.session_state.current_page == 'study':
                         st.markdown('</div>', unsafe_allow_html=True)
                         
                         st.markdown('<div class="answer-box">', unsafe_allow_html=True)
-                        st.markdown(f"**🤖 Answer:** {result.get('answer', 'No answer provided')}")
+                        st.markdown("**🤖 Answer:**")
+                        # Tokens render as they are generated
+                        answer = st.write_stream(answer_stream) or 'No answer provided'
                         st.markdown('</div>', unsafe_allow_html=True)
+                        if "error" in result:
+                            st.error(f"❌ Error: {result['error']} (Request ID: {result['request_id']})")
+                        else:
+                            qa_entry = {
+                                "timestamp": datetime.now().isoformat(),
+                                "source": result.get('source_name', youtube_url),
+                                "source_type": result.get('source_type', 'youtube'),
+                                "question": question_video,
+                                "answer": answer
+                            }
+                            st.session_state.qa_history.append(qa_entry)
                         
-                        qa_entry = {
-                            "timestamp": datetime.now().isoformat(),
-                            "source": result.get('source_name', youtube_url),
-                            "source_type": result.get('source_type', 'youtube'),
-                            "question": question_video,
-                            "answer": result.get('answer', 'No answer provided')
-                        }
-                        st.session_state.qa_history.append(qa_entry)
-                        
-                        st.success(f"✅ {result.get('message', 'Answer generated successfully!')}")
+                            st.success(f"✅ {result.get('message', 'Answer generated successfully!')}")
             elif not youtube_url:
                 st.warning("⚠️ Please enter a YouTube URL first.")
             elif not question_video:
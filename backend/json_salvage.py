@@ -0,0 +1,32 @@
+import json
+import re
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[\s,]*')
+def salvage_json_items(text, key):
+    """Return every complete element of the JSON array stored under key in a model response.
+    Elements are decoded one at a time, so markdown fences, text around the JSON, a reply cut off by
+    the token limit or one malformed element only lose the affected element, not the whole array.
+    Falls back to a top-level array when key is missing."""
+    match = re.search(r'"%s"\s*:\s*\[' % re.escape(key), text)
+    if match:
+        position = match.end()
+    else:
+        bracket = text.find('[')
+        if bracket < 0:
+            return []
+        position = bracket + 1
+    items = []
+    while position < len(text):
+        position = _WHITESPACE.match(text, position).end()
+        if position >= len(text) or text[position] == ']':
+            break
+        try:
+            item, position = _decoder.raw_decode(text, position)
+            items.append(item)
+        except json.JSONDecodeError:
+            # Skip the broken element and resume at the next object, if any
+            next_object = text.find('{', position + 1)
+            if next_object < 0:
+                break
+            position = next_object
+    return items
@@ -0,0 +1,17 @@
+import importlib
+class LazyModule:
+    """Stand-in for a heavy module that is only imported when one of its attributes is first used.
+    Lets the server start without paying for FAISS, PyMuPDF or the audio and YouTube libraries
+    until a request actually needs them. Importing is thread-safe via the import system's module locks."""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+    @property
+    def loaded(self):
+        return self._module is not None
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+    def __repr__(self):
+        return f"<lazy module {self._name!r} ({'loaded' if self.loaded else 'not loaded'})>"
@@ -0,0 +1,115 @@
+import heapq
+import time
+import logging
+import threading
+import itertools
+logger = logging.getLogger(__name__)
+class LLMQueueFull(Exception):
+    """The scheduler's queue is full (or the request was displaced or timed out); retry_after is an estimate in seconds"""
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+class LLMSlot:
+    """A granted generation slot; release it (or use it as a context manager) when the generation ends"""
+    def __init__(self, scheduler, priority):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.started = time.monotonic()
+        self._released = False
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.scheduler._release(self)
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc_info):
+        self.release()
+class LLMScheduler:
+    """Admit LLM generations by priority with a concurrency limit and a bounded wait queue.
+    Lower priority numbers go first; equal priorities are first come, first served. When max_queue
+    requests are already waiting, acquire() raises LLMQueueFull at once with a Retry-After estimate
+    built from recent generation times, so bursts get fast backpressure instead of piling up threads.
+    A request that outranks the last waiter (lowest priority, newest) takes its place instead, and the
+    displaced waiter gets LLMQueueFull, so background work cannot lock interactive requests out."""
+    def __init__(self, max_concurrency=2, max_queue=16, queue_timeout=300, default_duration=30.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, sequence)
+        self._displaced = set()  # waiting entries pushed out by higher-priority requests
+        self._sequence = itertools.count()
+        self._active = 0
+        self._average_duration = default_duration  # EWMA of generation seconds
+        self.admitted = 0
+        self.rejected = 0
+        self.displaced = 0
+        self.timed_out = 0
+    def _retry_after(self, ahead):
+        """Seconds until a request with ahead requests before it is likely to start"""
+        return max(1, int(self._average_duration * (ahead + 1) / self.max_concurrency))
+    def acquire(self, priority):
+        """Block until a slot is free for this priority and return it, or raise LLMQueueFull"""
+        with self._cond:
+            if self._active < self.max_concurrency and not self._waiting:
+                self._active += 1
+                self.admitted += 1
+                return LLMSlot(self, priority)
+            if len(self._waiting) >= self.max_queue:
+                last = max(self._waiting)
+                if priority >= last[0]:
+                    self.rejected += 1
+                    ahead = sum(1 for waiting_priority, _ in self._waiting if waiting_priority <= priority)
+                    raise LLMQueueFull(f"LLM queue is full ({len(self._waiting)} requests waiting)", self._retry_after(ahead))
+                # Make room by dropping the least urgent waiter; it raises LLMQueueFull when it wakes
+                self._waiting.remove(last)
+                heapq.heapify(self._waiting)
+                self._displaced.add(last)
+                self.displaced += 1
+                self._cond.notify_all()
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, entry)
+            deadline = time.monotonic() + self.queue_timeout
+            while entry in self._displaced or not (self._waiting[0] == entry and self._active < self.max_concurrency):
+                if entry in self._displaced:
+                    self._displaced.discard(entry)
+                    ahead = sum(1 for waiting_priority, _ in self._waiting if waiting_priority <= priority)
+                    raise LLMQueueFull("Displaced from the LLM queue by higher-priority requests", self._retry_after(ahead))
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self.timed_out += 1
+                    self._cond.notify_all()
+                    raise LLMQueueFull(f"Timed out after {self.queue_timeout}s waiting for the LLM", self._retry_after(len(self._waiting)))
+                self._cond.wait(remaining)
+            heapq.heappop(self._waiting)
+            self._active += 1
+            self.admitted += 1
+            # The next waiter may also fit if several slots are free
+            self._cond.notify_all()
+            return LLMSlot(self, priority)
+    def _release(self, slot):
+        with self._cond:
+            self._active -= 1
+            duration = time.monotonic() - slot.started
+            self._average_duration = 0.8 * self._average_duration + 0.2 * duration
+            self._cond.notify_all()
+    def stats(self):
+        """Counters for the health endpoint"""
+        with self._cond:
+            queued = {}
+            for priority, _ in self._waiting:
+                queued[priority] = queued.get(priority, 0) + 1
+            return {
+                "active": self._active,
+                "max_concurrency": self.max_concurrency,
+                "queued": len(self._waiting),
+                "queued_by_priority": queued,
+                "max_queue": self.max_queue,
+                "average_generation_seconds": round(self._average_duration, 2),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "displaced": self.displaced,
+                "timed_out": self.timed_out
+            }
@@ -0,0 +1,142 @@
+import json
+import time
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+logger = logging.getLogger(__name__)
+class OllamaUnavailable(Exception):
+    """Ollama is down or doesn't have the model; retry_after is a suggested wait in seconds"""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+class OllamaClient:
+    """Thread-safe Ollama HTTP client sharing one pooled keep-alive session across requests.
+    Connection failures are retried with backoff; reads are not, since a generate call may already have
+    started on the server. Timeouts are (connect, read) pairs, and for streamed generations the read
+    timeout bounds the wait between chunks rather than the whole answer. keep_alive, if set, is sent with
+    every generation so the model (and its cached prompt prefix) stays loaded between requests."""
+    def __init__(self, base_url, model, pool_size=10, connect_timeout=5, read_timeout=180, retries=2, keep_alive=None):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.keep_alive = keep_alive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.session = requests.Session()
+        retry = Retry(total=retries, connect=retries, read=0, status=0, backoff_factor=0.2)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+    def _timeout(self, read_timeout):
+        return (self.connect_timeout, read_timeout if read_timeout is not None else self.read_timeout)
+    def _payload(self, prompt, stream, options, params):
+        payload = {"model": self.model, "prompt": prompt, "stream": stream, "options": options or {}}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        payload.update(params)
+        return payload
+    def _check(self, response):
+        if response.status_code != 200:
+            raise ValueError(f"Ollama API error: Status {response.status_code} - {response.text}")
+    def list_models(self, timeout=10):
+        """Names of the models available on the server"""
+        response = self.session.get(f"{self.base_url}/api/tags", timeout=self._timeout(timeout))
+        self._check(response)
+        return [m["name"] for m in response.json().get("models", [])]
+    def generate(self, prompt, options=None, timeout=None, **params):
+        """Run a non-streaming generation and return Ollama's response object.
+        Extra params (format, context, keep_alive, ...) are passed through to /api/generate."""
+        payload = self._payload(prompt, False, options, params)
+        response = self.session.post(f"{self.base_url}/api/generate", json=payload, timeout=self._timeout(timeout))
+        self._check(response)
+        return response.json()
+    def generate_stream(self, prompt, options=None, timeout=None, **params):
+        """Yield Ollama's streamed response objects for a generation; the last one has done=True.
+        Closing the generator early closes the connection, which stops generation on the server."""
+        payload = self._payload(prompt, True, options, params)
+        with self.session.post(f"{self.base_url}/api/generate", json=payload, stream=True,
+                               timeout=self._timeout(timeout)) as response:
+            self._check(response)
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise ValueError(f"Ollama API error: {chunk['error']}")
+                yield chunk
+                if chunk.get("done"):
+                    return
+class OllamaMonitor:
+    """Background thread that probes Ollama's model list on an interval and caches whether it is ready.
+    Requests check the cached state with ready()/check() in O(1) instead of probing Ollama themselves.
+    Probes run every up_interval seconds while Ollama is healthy and every down_interval while it isn't,
+    so recovery is noticed quickly. Until the first probe completes, callers wait for it briefly."""
+    def __init__(self, client, model, up_interval=30, down_interval=5, probe_timeout=5):
+        self.client = client
+        self.model = model
+        self.up_interval = up_interval
+        self.down_interval = down_interval
+        self.probe_timeout = probe_timeout
+        self._ready = False
+        self._error = "Ollama readiness not checked yet"
+        self._models = []
+        self._last_checked = None
+        self._probed = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+    def start(self):
+        """Start the probe thread (once)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ollama-monitor", daemon=True)
+                self._thread.start()
+        return self
+    def _run(self):
+        while True:
+            self.probe()
+            self._wake.wait(self.up_interval if self._ready else self.down_interval)
+            self._wake.clear()
+    def probe(self):
+        """Query Ollama now and update the cached state"""
+        try:
+            models = self.client.list_models(timeout=self.probe_timeout)
+            if self.model in models:
+                ready, error = True, None
+            else:
+                ready, error = False, f"Model '{self.model}' not found. Available: {models}"
+        except requests.exceptions.ConnectionError:
+            models, ready, error = [], False, f"Cannot connect to Ollama server at {self.client.base_url}. Please start it with 'ollama serve'"
+        except Exception as e:
+            models, ready, error = [], False, f"Ollama health check failed: {str(e)}"
+        if ready != self._ready or error != self._error:
+            if ready:
+                logger.info(f"✅ Ollama ready with model: {self.model}")
+            else:
+                logger.warning(f"⚠ Ollama not ready: {error}")
+        self._ready, self._error, self._models = ready, error, models
+        self._last_checked = time.time()
+        self._probed.set()
+        return ready
+    def mark_down(self, error):
+        """Record a failure seen by a request (e.g. connection refused) and re-probe soon"""
+        self._ready = False
+        self._error = error
+        self._wake.set()
+    def ready(self):
+        if not self._probed.is_set():
+            self._probed.wait(self.probe_timeout)
+        return self._ready
+    def check(self):
+        """Raise OllamaUnavailable immediately if the last probe found Ollama not ready"""
+        if not self.ready():
+            raise OllamaUnavailable(self._error, retry_after=self.down_interval)
+    def stats(self):
+        """State for the health endpoint"""
+        return {
+            "ready": self._ready,
+            "error": self._error,
+            "models": self._models,
+            "last_checked": self._last_checked
+        }
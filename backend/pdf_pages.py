@@ -0,0 +1,33 @@
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from lazy import LazyModule
+fitz = LazyModule('fitz')  # PyMuPDF, imported once per worker on its first shard
+_pools = {}
+_pools_lock = threading.Lock()
+def extract_pdf_pages(file_path, start, end):
+    """Extract pages [start, end) of a PDF; runs in worker processes, each opening the file independently"""
+    doc = fitz.open(file_path)
+    try:
+        return [f"\n--- Page {page_num + 1} ---\n{doc[page_num].get_text()}" for page_num in range(start, end)]
+    finally:
+        doc.close()
+def get_pdf_pool(workers):
+    """Return the shared, long-lived extraction pool with the given number of workers, starting it on first use.
+    Workers come from a forkserver (or are spawned) rather than forked from the server, whose embedding,
+    monitor and request threads could leave locks held in a forked child; concurrent uploads share them."""
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            context = multiprocessing.get_context(method)
+            if method == 'forkserver':
+                context.set_forkserver_preload(['pdf_pages'])
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return pool
+def discard_pdf_pool(workers, pool):
+    """Drop a broken pool (e.g. a worker was killed) so the next extraction starts a fresh one"""
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
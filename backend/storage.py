@@ -0,0 +1,113 @@
+import os
+import re
+import json
+import logging
+import numpy as np
+from lazy import LazyModule
+faiss = LazyModule('faiss')
+logger = logging.getLogger(__name__)
+DOC_ID_PATTERN = re.compile(r'^[A-Za-z0-9_\-]{1,128}$')
+class ChunkList:
+    """Read-only sequence of chunks stored as one text buffer plus int32 start/end offset arrays.
+    Chunk strings are only materialised when indexed, so overlapping chunks share the buffer."""
+    __slots__ = ('text', 'starts', 'ends')
+    def __init__(self, text, starts, ends):
+        self.text = text
+        self.starts = np.asarray(starts, dtype=np.int32)
+        self.ends = np.asarray(ends, dtype=np.int32)
+    def __len__(self):
+        return len(self.starts)
+    def __getitem__(self, i):
+        return self.text[self.starts[i]:self.ends[i]]
+    def __iter__(self):
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+            yield self.text[start:end]
+    @property
+    def nbytes(self):
+        """Size of the offset arrays; the text buffer is owned by the document"""
+        return self.starts.nbytes + self.ends.nbytes
+class DocumentStorage:
+    """Persist ingested documents (metadata, cleaned text, chunks and FAISS index) under a data directory.
+    Layout: <data_dir>/documents/<doc_id>/{meta.json, text.txt, chunk_offsets.npy, index.faiss}"""
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.documents_dir = os.path.join(data_dir, 'documents')
+        os.makedirs(self.documents_dir, exist_ok=True)
+    def _document_dir(self, doc_id):
+        if not DOC_ID_PATTERN.match(doc_id):
+            raise ValueError(f"Invalid doc_id: {doc_id!r}")
+        return os.path.join(self.documents_dir, doc_id)
+    def _write_atomic(self, path, write):
+        """Write via a temporary file and rename so a crash never leaves a half-written file"""
+        tmp_path = f"{path}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    def _write_text(self, path, text):
+        def write(tmp_path):
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                f.write(text)
+        self._write_atomic(path, write)
+    def save_text(self, doc):
+        """Persist a document's metadata and cleaned text"""
+        doc_dir = self._document_dir(doc['doc_id'])
+        os.makedirs(doc_dir, exist_ok=True)
+        self._write_text(os.path.join(doc_dir, 'text.txt'), doc['cleaned_text'])
+        meta = {
+            'doc_id': doc['doc_id'],
+            'source_name': doc['source_name'],
+            'source_type': doc['source_type'],
+            'timestamp': doc['timestamp']
+        }
+        self._write_text(os.path.join(doc_dir, 'meta.json'), json.dumps(meta))
+    def save_index(self, doc):
+        """Persist a document's chunk offsets and FAISS index; the chunk text lives in text.txt"""
+        doc_dir = self._document_dir(doc['doc_id'])
+        os.makedirs(doc_dir, exist_ok=True)
+        chunks = doc['chunks']
+        def write_offsets(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.stack([chunks.starts, chunks.ends]))
+        self._write_atomic(os.path.join(doc_dir, 'chunk_offsets.npy'), write_offsets)
+        self._write_atomic(os.path.join(doc_dir, 'index.faiss'),
+                           lambda tmp_path: faiss.write_index(doc['index'], tmp_path))
+    def read_index(self, path):
+        """Load a FAISS index with its codes memory-mapped read-only, so pages are read in as searches touch them.
+        IO_FLAG_MMAP_IFC maps flat code arrays (Flat, SQ, PQ, HNSW storage, IVF lists); IO_FLAG_MMAP alone
+        only applies to on-disk inverted lists and reads everything else into memory. Falls back to a full read."""
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        except Exception as e:
+            logger.warning(f"⚠ Memory-mapped load not supported for {path}, reading fully: {e}")
+            return faiss.read_index(path)
+    def load(self, doc_id):
+        """Load a persisted document, or return None if it is not on disk"""
+        try:
+            doc_dir = self._document_dir(doc_id)
+        except ValueError:
+            return None
+        meta_path = os.path.join(doc_dir, 'meta.json')
+        text_path = os.path.join(doc_dir, 'text.txt')
+        if not (os.path.exists(meta_path) and os.path.exists(text_path)):
+            return None
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                doc = json.load(f)
+            with open(text_path, encoding='utf-8', newline='') as f:
+                doc['cleaned_text'] = f.read()
+            doc['chunks'] = None
+            doc['index'] = None
+            offsets_path = os.path.join(doc_dir, 'chunk_offsets.npy')
+            index_path = os.path.join(doc_dir, 'index.faiss')
+            if os.path.exists(offsets_path) and os.path.exists(index_path):
+                offsets = np.load(offsets_path)
+                doc['chunks'] = ChunkList(doc['cleaned_text'], offsets[0], offsets[1])
+                doc['index'] = self.read_index(index_path)
+            logger.info(f"💾 Loaded document {doc_id[:16]} from disk")
+            return doc
+        except Exception as e:
+            logger.error(f"❌ Failed to load document {doc_id[:16]} from disk: {e}")
+            return None
+    def list_doc_ids(self):
+        """List the IDs of all persisted documents"""
+        return [name for name in os.listdir(self.documents_dir)
+                if os.path.exists(os.path.join(self.documents_dir, name, 'meta.json'))]